@@ -0,0 +1,241 @@
+#!/usr/bin/env python
+
+# License: GPLv3. See accompanying LICENSE file.
+# No warranty. You are responsible for your use of this program.
+
+# Purpose:
+# Measure how fast combine-kits.py, phase-kit.py and extend-kit.py run, and
+# how much memory they use, without using anyone's real DNA data. A made-up
+# family trio is generated in the format of each company (see
+# dnakit/synthetic.py), for each of the SNP counts and compressions below.
+# Each tool is then run on it in a fresh process, timing each of its stages,
+# and the results are saved as a .json file, so the results of different
+# versions can be compared.
+#
+# The stages are the same steps the tools take:
+#   read: read and parse the data files, saving them in a new kit cache
+#   read-cached: read the same files again, from the cache
+#   work: the tool's own work (combine, phase or extend), on the kits read
+#   gender: guess the gender of the (combined or child) kit
+#   output: write the output file
+# along with the finer stages the tools mark inside these (see
+# dnakit/stages.py), such as decompress, split, encode, sort and format.
+# For combine-kits.py, the child's kits from every company are combined; for
+# phase-kit.py and extend-kit.py, the child's 23andMe kit with the mother's
+# FTDNA kit and the father's AncestryDNA kit.
+
+# Instructions:
+# Edit the settings below, then run this script in python3. Generating the
+# larger kits takes a while, so they are kept in DATADIR for the next run.
+
+# Number of SNPs in the made-up kits; each company's kit has about 85% of them.
+SNPCOUNTS = [100000, 500000, 2000000]
+
+# Compressions of the data files: 'zip', 'gz' or None (plain .csv)
+COMPRESSIONS = ['zip', 'gz']
+
+# Tools to measure
+TOOLS = ['combine', 'phase', 'extend']
+
+# Number of times to run each tool on each set of kits
+REPEAT = 1
+
+# Random number seed for making the kits; the same seed gives the same kits.
+SEED = 1
+
+# Folder for the made-up kits and the output files. It's safe to delete.
+DATADIR = 'bench-data'
+
+# The results are written to this file
+REPORT = 'bench-report.json'
+
+#--- adjust settings above this line, then run ---
+
+import contextlib
+import csv
+import datetime
+import io
+import json
+import multiprocessing
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+
+import numpy as np
+
+try:
+    import resource
+except ImportError:
+    # not available on Windows; peak memory use is not measured there
+    resource = None
+
+from dnakit.callstore import CallStore
+from dnakit.combine import FIELDNAMES as COMBINED_FIELDS, output_calls
+from dnakit.extend import FIELDNAMES as EXTENDED_FIELDS, extend_part
+from dnakit.kit import chr_order, load_kits
+from dnakit.phase import FIELDNAMES as PHASED_FIELDS, phase_part
+from dnakit.stages import report, stage, start_recording
+from dnakit.synthetic import VENDORS, make_trio, write_kit
+from dnakit.trio import load_trio_kits, run_part, share_kits
+from dnakit.writer import output_file, write_csv
+
+# the companies of the kits of each person in the trio
+TRIO_VENDORS = {'child': VENDORS, 'mother': ('FTDNA',),
+                'father': ('AncestryDNA',)}
+
+# file name endings for each compression
+EXTENSIONS = {'zip': '.zip', 'gz': '.csv.gz', None: '.csv'}
+
+# Make the kits of a trio with nsnps SNPs, unless they were already made.
+# Returns a dictionary of (person, company) to file name.
+def make_kits(nsnps, compression):
+    folder = os.path.join(DATADIR, '{}-{}-seed{}'.format(nsnps, compression,
+                                                              SEED))
+    files = {(p, v): os.path.join(folder, '{}-{}{}'.format(
+                 p, v, EXTENSIONS[compression]))
+             for p, vendors in TRIO_VENDORS.items() for v in vendors}
+    done = os.path.join(folder, 'done')
+    if os.path.exists(done):
+        return files
+
+    print('Making kits with {} SNPs in {}'.format(nsnps, folder))
+    os.makedirs(folder, exist_ok=True)
+    panel, people = make_trio(nsnps, SEED)
+    rng = np.random.default_rng(SEED + 1)
+    for (p, v), f in sorted(files.items()):
+        write_kit(f, panel, people[p], v, rng)
+    open(done, 'w').close()
+    return files
+
+
+# the peak memory use of this process so far, in MB, or None if unknown.
+# On Linux, getrusage counts the memory of the process that started this one
+# too, so the peak kept by /proc is used instead.
+def peak_rss():
+    try:
+        with open('/proc/self/status') as sf:
+            for line in sf:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) / 1024.0
+    except (IOError, OSError, ValueError):
+        pass
+    if resource is None:
+        return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # bytes on macOS, kilobytes elsewhere
+    return rss / (1 << 20) if sys.platform == 'darwin' else rss / 1024.0
+
+# Read the kits into a new cache folder, then again from the cache.
+# read(files, cachedir) must return the kits.
+def timed_reads(read, files, cachedir):
+    with stage('read'):
+        read(files, cachedir)
+    with stage('read-cached'):
+        return read(files, cachedir)
+
+# The stages of combine-kits.py, on the child's kits
+def bench_combine(files, outfile, cachedir):
+    infiles = [files['child', v] for v in VENDORS]
+    kits = timed_reads(lambda f, c: load_kits(f, c, 1), infiles,
+                           cachedir)
+    with stage('work'):
+        store = CallStore.from_kits(infiles, kits)
+        kit = store.kit()
+    with stage('gender'):
+        gender = kit.guess_gender()
+    with stage('output'):
+        kit, nocalls = output_calls(kit, gender)
+        write_csv(outfile, COMBINED_FIELDS,
+                  [kit.rsid_names(), kit.chromosomes(), kit.pos,
+                   kit.genotypes()])
+    return len(kit)
+
+# The stages of phase-kit.py or extend-kit.py: func is phase_part or
+# extend_part
+def bench_trio(files, outfile, cachedir, func, fieldnames):
+    trio = (files['child', '23andMe'], files['mother', 'FTDNA'],
+            files['father', 'AncestryDNA'], outfile)
+    kits = timed_reads(lambda f, c: load_trio_kits([f], c, 1), trio,
+                           cachedir)
+    with stage('gender'):
+        gender = kits[trio[0]].guess_gender()
+    with stage('work'):
+        share_kits(kits)
+        parts = [run_part((func, trio, chrom, gender))
+                     for chrom in range(len(chr_order))]
+    with stage('output'):
+        with output_file(outfile) as out:
+            csv.writer(out).writerow(fieldnames)
+            for text, counts in parts:
+                out.write(text)
+    return sum(text.count('\n') for text, counts in parts)
+
+# Run one tool on the kits, returning its result for the report. This runs in
+# a process of its own, so the peak memory use is this tool's alone.
+def run_tool(args):
+    tool, files, outfile = args
+    # the stages the tools mark are recorded too, inside these; the memory
+    # is measured as a whole, not by tracing, which would slow the tools down
+    start_recording(memory=False)
+    cachedir = tempfile.mkdtemp(prefix='bench-cache-', dir=DATADIR)
+    try:
+        # the tools' messages are not wanted here
+        with contextlib.redirect_stdout(io.StringIO()):
+            if tool == 'combine':
+                rows = bench_combine(files, outfile, cachedir)
+            elif tool == 'phase':
+                rows = bench_trio(files, outfile, cachedir, phase_part,
+                                      PHASED_FIELDS)
+            else:
+                rows = bench_trio(files, outfile, cachedir, extend_part,
+                                      EXTENDED_FIELDS)
+    finally:
+        shutil.rmtree(cachedir, ignore_errors=True)
+    return dict(report(), rows=rows, peak_rss_mb=peak_rss())
+
+# the git commit of this copy of the tools, or None if it's not known
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True,
+                                  text=True, cwd=os.path.dirname(
+                                      os.path.abspath(__file__)),
+                                  check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def main():
+    report = {'date': datetime.datetime.now().isoformat(timespec='seconds'),
+              'commit': git_commit(), 'python': platform.python_version(),
+              'numpy': np.__version__, 'platform': platform.platform(),
+              'processors': multiprocessing.cpu_count(), 'runs': []}
+    # each tool run gets a new process, not a copy of this one
+    context = multiprocessing.get_context('spawn')
+    for nsnps in SNPCOUNTS:
+        for compression in COMPRESSIONS:
+            files = make_kits(nsnps, compression)
+            size = sum(os.path.getsize(f) for f in files.values())
+            for tool in TOOLS:
+                outfile = os.path.join(DATADIR, '{}-output.csv'.format(tool))
+                for i in range(REPEAT):
+                    with context.Pool(1) as pool:
+                        result = pool.apply(run_tool, ((tool, files, outfile),))
+                    os.remove(outfile)
+                    print('{} {} SNPs {}: {:.2f}s, {} MB'.format(
+                        tool, nsnps, compression, result['wall'],
+                        '?' if result['peak_rss_mb'] is None
+                        else int(result['peak_rss_mb'])))
+                    report['runs'].append(dict(result, tool=tool, snps=nsnps,
+                                                   compression=compression,
+                                                   input_bytes=size,
+                                                   repeat=i))
+
+    with open(REPORT, 'w') as rf:
+        json.dump(report, rf, indent=1)
+    print('Wrote {}'.format(REPORT))
+
+# the tools run in separate processes, which must not run main() again
+if __name__ == '__main__':
+    main()
@@ -22,6 +22,12 @@
 #
 # Run:
 # - check variables in section below and run with segment files
+#   python cluster-segments.py segments1.csv segments2.csv
+# - to save the graph instead of showing it, e.g. with no display
+#   python cluster-segments.py --out hot-spots.png segments1.csv segments2.csv
+# - to save the graphs of many sets of segment files at once, list them in a
+#   .csv file (see batch below)
+#   python cluster-segments.py --batch projects.csv
 #
 
 # number of bins on each chromosome for histograms
@@ -40,6 +46,33 @@ nchrom = 23
 chroms = ['1','5','6','8']                              # a few chromosomes
 chroms = [str(ii) for ii in range(1,nchrom)] + ['X',]   # all chromosomes
 
+# To bin by genetic distance, in centimorgans (cM), instead of base pairs,
+# name a genetic map here: a file, or a folder of files, e.g.
+# 'genetic_map_hg19_withX.txt.gz' (see dnakit/genmap.py for the formats it can
+# be). The segment files must be of the same build as the map, usually build
+# 37.
+genetic_map = None
+
+# folder for keeping the genetic map, already read, for the next run; it's
+# safe to delete it at any time
+map_cache = 'kit-cache'
+
+# To save the graph in a file instead of showing it in a window, e.g. on a
+# computer with no display, name the file here or give it with --out. It may
+# end in .png, .svg or .pdf. Saved graphs are figure_size inches wide and high.
+outfile = None
+figure_size = (20, 14)
+
+# To graph many sets of segment files in one run, e.g. every project each
+# night, list them in a .csv file, here or with --batch: one set per line,
+# the segment files of a graph, then the file to save it in. The segment files
+# on the command line are then not used.
+batch = None
+
+# Number of sets of segment files to graph at the same time, each in its own
+# process. Use 1 for one after another, or None to use all processors.
+workers = None
+
 
 #----- most tuning and editing is above this line -----
 
@@ -91,7 +124,14 @@ chr_maxes = {
     'Y': 59373566
     }
 
-import csv, os, six, sys, functools
+import argparse, csv, multiprocessing, os, six, sys
+
+import numpy as np
+
+from dnakit.kit import chrom_codes
+
+# the types of file a graph can be saved as
+saved_formats = ('.png', '.svg', '.pdf')
 
 # Test if this is a known format .csv and return the header names
 # in the order chromosome,start,end. Matches a signature if all column
@@ -104,140 +144,265 @@ def match_signature(fieldnames, signatures):
             return signatures[signature]
     return None
 
-# python2 may not work with this script (untested), so print a warning
-if six.PY2:
-    print('This program is tested with Python 3.x, and you have Python 2.x.')
-    print('This message is a warning; program continues to run.')
-    print('Refer to https://www.python.org/downloads/')
-
-# This program can graph either actual max chromosome position discovered among
-# matches or use the chromosome length defined above. If using the scale based
-# on actual max, all input files need to be scanned to determine the maximum
-# chromosome positions
-maxes = {}
-if actual_max:
-    # loop through input files
-    for fname in sys.argv[1:]:
-        csvfile = open(fname)
-        d = csv.DictReader(csvfile)
-        csv_cols = match_signature(d.fieldnames, csv_signatures)
+# With a genetic map, segment positions are converted to cM, and the graph
+# range of each chromosome is its length in the map. Returns False if the map
+# can't be read. Also run in each worker process of a batch.
+gmap = None
+def load_genetic_map():
+    global gmap, chr_maxes
+    if not genetic_map:
+        return True
+    from dnakit.genmap import load_map
+    gmap = load_map(genetic_map, map_cache)
+    if gmap is None:
+        return False
+    chr_maxes = {cn: gmap.length(chrom_codes([cn])[0]) for cn in chr_maxes}
+    return True
+
+# Read a segment file once, into a dictionary of chromosome name to (starts,
+# ends) arrays, for the chromosomes being plotted. Lines with no chromosome,
+# or too short to have all of the columns, are skipped. With a genetic map,
+# the positions are in cM. Returns None if the file isn't a known format.
+def read_segments(fname):
+    with open(fname) as csvfile:
+        reader = csv.reader(csvfile)
+        header = next(reader, [])
+        csv_cols = match_signature(header, csv_signatures)
         if not csv_cols:
-            print('Input .csv file does not match a known format. Exiting.')
-            sys.exit(1)
-
-        segs = [(line[csv_cols[0]], int(line[csv_cols[1]]),
-                     int(line[csv_cols[2]]))
-                for line in d]
-
-        # determine maximum address for each chromosome
-        for cn in chroms:
-            try:
-                mm = max([s[2] for s in segs if s[0] == cn])
-                try:
-                    maxes[cn] = max(mm, maxes[cn])
-                except KeyError:
-                    maxes[cn] = mm
-            except ValueError:
-                #print('nothing for chr.{}'.format(cn))
-                pass
-else:
-    maxes = chr_maxes
-
-
-# data struct for keeping track of number of matches for each chromosome
-# section (histogram bin)
-counts = {ii:[0,] * num_bins for ii in maxes}
-
-# loop through input files, count each segment where it lands
-for fname in sys.argv[1:]:
-    csvfile = open(fname)
-    d = csv.DictReader(csvfile)
-    csv_cols = match_signature(d.fieldnames, csv_signatures)
-    # print('relevant columns:', csv_cols)
-
-    # read all lines of csv file as long as there's a chromosome number
-    segs = [(line[csv_cols[0]].strip(), int(line[csv_cols[1]]),
-                 int(line[csv_cols[2]]))
-                for line in d if line[csv_cols[0]]]
-
-    # bump bin count if any part of matching segment is in bin range
-    for seg in segs:
-
-        # skip if we're not plotting this chromosome
-        if seg[0] not in chroms:
-            continue
-
-        binsize = 1.0 * maxes[seg[0]] / num_bins
-        try:
-            for ib in range(0,num_bins):
-                endpoint1 = ib * binsize
-                endpoint2 = (ib+1) * binsize
-                if seg[1] < endpoint2 and seg[2] >= endpoint1:
-                    counts[seg[0]][ib] += 1
-        except:
-            # oops some unknown error happened that will have to be debugged
-            print(seg, ib)
-            raise
-
-# uncomment if you're a nerd and want to see inner workings
-#print(segs)
-#print(maxes)
-#print(counts['1'])
+            print('Input .csv file {} does not match a known format.'.format(
+                fname))
+            return None
+        ci, si, ei = [header.index(c) for c in csv_cols]
+        ncols = max(ci, si, ei) + 1
+        rows = [row for row in reader
+                    if len(row) >= ncols and row[ci].strip()]
+    names = np.array([row[ci].strip() for row in rows], dtype=object)
+    starts = np.array([int(row[si]) for row in rows], dtype=np.float64)
+    ends = np.array([int(row[ei]) for row in rows], dtype=np.float64)
+
+    # group the columns by chromosome with one sort, rather than one scan
+    # for each chromosome
+    segs = {}
+    if not len(names):
+        return segs
+    cnames, which = np.unique(names, return_inverse=True)
+    order = np.argsort(which, kind='stable')
+    bounds = np.searchsorted(which[order], np.arange(len(cnames) + 1))
+    for i, cn in enumerate(cnames):
+        if cn in chroms:
+            on = order[bounds[i]:bounds[i + 1]]
+            segs[cn] = in_map_units(cn, starts[on], ends[on])
+    return segs
+
+# the positions of a chromosome's segments, in cM when binning with a genetic
+# map
+def in_map_units(cn, starts, ends):
+    if gmap is None:
+        return starts, ends
+    codes = np.full(len(starts), chrom_codes([cn])[0], dtype=np.uint8)
+    return gmap.cm_at(codes, starts), gmap.cm_at(codes, ends)
+
+# Count the segments, given by arrays of start and end positions, that are in
+# each of num_bins equal bins from 0 to top. A segment is in every bin from the
+# first that ends after its start to the last that starts at or before its
+# end. Rather than testing each bin, each segment adds 1 at its first bin and
+# takes 1 away after its last, and a running sum of that gives the counts.
+def bin_counts(starts, ends, top):
+    edges = np.arange(num_bins + 1) * (1.0 * top / num_bins)
+    first = np.searchsorted(edges[1:], starts, side='right')
+    last = np.searchsorted(edges[:-1], ends, side='right') - 1
+    some = first <= last
+    diff = np.bincount(first[some], minlength=num_bins + 1) - \
+        np.bincount(last[some] + 1, minlength=num_bins + 1)
+    return np.cumsum(diff[:num_bins])
+
+# Read the segment files of one graph and count them. Returns the graph range
+# and the histogram counts of each chromosome, as two dictionaries, or None if
+# a file isn't a known format.
+def count_segments(fnames):
+    # All of the segments of the input files, by chromosome, read only once:
+    # the graph range with actual_max and the histogram counts both come from
+    # here.
+    segments = {}
+    for fname in fnames:
+        segs = read_segments(fname)
+        if segs is None:
+            return None
+        for cn, (starts, ends) in segs.items():
+            if cn in segments:
+                starts = np.concatenate([segments[cn][0], starts])
+                ends = np.concatenate([segments[cn][1], ends])
+            segments[cn] = (starts, ends)
+
+    # This program can graph either actual max chromosome position discovered
+    # among matches or use the chromosome length defined above. A chromosome
+    # with no segments (or none within the genetic map) has no actual max.
+    if actual_max:
+        maxes = {}
+        for cn, (starts, ends) in segments.items():
+            mm = np.fmax.reduce(ends) if len(ends) else np.nan
+            if not np.isnan(mm):
+                maxes[cn] = float(mm)
+    else:
+        maxes = chr_maxes
+
+    # data struct for keeping track of number of matches for each chromosome
+    # section (histogram bin); bump bin count if any part of matching segment
+    # is in bin range
+    counts = {ii:np.zeros(num_bins, dtype=np.int64) for ii in maxes}
+    for cn, (starts, ends) in segments.items():
+        if cn in maxes:
+            counts[cn] += bin_counts(starts, ends, maxes[cn])
+
+    # uncomment if you're a nerd and want to see inner workings
+    #print(segments)
+    #print(maxes)
+    #print(counts['1'])
+
+    return maxes, counts
 
 
 # ----- code below produces the actual graph, using matplotlib.pyplot -----
 
-import matplotlib.pyplot as plt
+# Graph the counts of the segment files fnames, showing it in a window, or
+# saving it in outfile if one is given. matplotlib is only imported here, and
+# a saved graph is drawn with no window, so it works with no display.
+def plot(fnames, maxes, counts, outfile=None):
+    import matplotlib
+    if outfile:
+        matplotlib.use('Agg')
+    import matplotlib.pyplot as plt
 
-# number of subplot rows and columns
-ncols = 4
-nrows = int((len(chroms) - 1) / ncols) + 1
+    # number of subplot rows and columns
+    ncols = 4
+    nrows = int((len(chroms) - 1) / ncols) + 1
 
-# set up a sub-plot for each chromosome number in chroms list
-plots = [(nrows,ncols,i) for i in range(1,len(chroms)+1)]
-fig = plt.figure()
+    # set up a sub-plot for each chromosome number in chroms list
+    plots = [(nrows,ncols,i) for i in range(1,len(chroms)+1)]
+    fig = plt.figure(figsize=figure_size if outfile else None)
 
-# increase height padding between subplots
-fig.subplots_adjust(hspace=0.6)
+    # increase height padding between subplots
+    fig.subplots_adjust(hspace=0.6)
 
-# render each subplot; refer to matplotlib.pyplot documentation
-for chrom in chroms:
+    # render each subplot; refer to matplotlib.pyplot documentation
+    for chrom in chroms:
 
-    # uncomment if you like to see a chatty program
-    # print('Chromosome', chrom, '...')
+        # uncomment if you like to see a chatty program
+        # print('Chromosome', chrom, '...')
 
-    idx = chroms.index(chrom)
-    ax = fig.add_subplot(plots[idx][0], plots[idx][1], plots[idx][2])
-    left = range(num_bins)
+        idx = chroms.index(chrom)
+        ax = fig.add_subplot(plots[idx][0], plots[idx][1], plots[idx][2])
+        left = range(num_bins)
+        try:
+            height = counts[chrom]
+        except KeyError:
+            height = [0,] * num_bins
+        # a chromosome with no segments has no actual max
+        top = maxes.get(chrom, chr_maxes.get(chrom, 0))
+        if gmap:
+            tick_label = ['{:,.0f}cM'.format(top/num_bins * bin) for bin in range(num_bins)]
+        else:
+            tick_label = ['{:,.0f}m'.format(top/num_bins/1000000. * bin) for bin in range(num_bins)]
+
+        ax.bar(left, height, tick_label=tick_label, width=0.8)
+        ax.tick_params(labelrotation=90,labelsize=7)
+        ax.set_xlabel('chr.{}'.format(chroms[idx]))
+        ax.set_ymargin(.2)
+
+    fig.suptitle('Histogram of segments matched for {}'.format(fnames[0]))
+    fig.supylabel('match counts on region')
+
+    if outfile:
+        fig.savefig(outfile)
+        plt.close(fig)
+    else:
+        plt.show()
+
+# Graph one set of segment files, given as (segment files, output file), in
+# this process or a worker. Returns False if a file couldn't be read.
+def graph_set(job):
+    fnames, outfile = job
     try:
-        height = counts[chrom]
-    except KeyError:
-        height = [0,] * num_bins
-    tick_label = ['{:,.0f}m'.format(maxes[chrom]/num_bins/1000000. * bin) for bin in range(num_bins)]
-
-    ax.bar(left, height, tick_label=tick_label, width=0.8)
-    ax.tick_params(labelrotation=90,labelsize=7)
-    ax.set_xlabel('chr.{}'.format(chroms[idx]))
-    ax.set_ymargin(.2)
-
-fig.suptitle('Histogram of segments matched for {}'.format(sys.argv[1]))
-fig.supylabel('match counts on region')
-
-plt.show()
-    
-
-sys.exit(0)
-
-
-
-# ----- code below is currently unused -----
-
-left = range(num_bins)
-height = counts[8]
-tick_label = ['{:,.0f}'.format(maxes['8']/num_bins * bin) for bin in range(num_bins)]
-plt.bar(left, height, tick_label=tick_label, width=0.8)
-plt.xlabel('chr 8 location')
-plt.ylabel('count of matches')
-plt.title('Wall matches vs chromosome 8')
-plt.xticks(rotation=90)
-plt.show()
+        result = count_segments(fnames)
+    except (IOError, OSError, ValueError) as e:
+        print('Could not read {}: {}'.format(', '.join(fnames), e))
+        return False
+    if result is None:
+        return False
+    plot(fnames, result[0], result[1], outfile)
+    if outfile:
+        print('Saved {}'.format(outfile))
+    return True
+
+# True if a graph can be saved in a file of this name
+def saved_format(outfile):
+    return os.path.splitext(outfile)[1].lower() in saved_formats
+
+# Read the sets of segment files to graph from a .csv file, one set per line:
+# the segment files of one graph, then the file to save it in.
+def read_sets(f):
+    sets = []
+    with open(f) as sf:
+        lines = [l for l in sf if l.strip() and not l.startswith('#')]
+    for row in csv.reader(lines):
+        row = [x.strip() for x in row if x.strip()]
+        if len(row) < 2 or not saved_format(row[-1]):
+            print('Skipping {} in {} - requires segment files, then an '
+                      'output file ending in {}'.format(
+                          row, f, ', '.join(saved_formats)))
+            continue
+        sets.append((row[:-1], row[-1]))
+    return sets
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Graph histograms of where the segments of the segment '
+            'files fall on each chromosome')
+    parser.add_argument('files', nargs='*', metavar='FILE',
+                            help='segment .csv file')
+    parser.add_argument('--out', default=outfile, metavar='FILE',
+                            help='save the graph in this file instead of '
+                                'showing it (see outfile)')
+    parser.add_argument('--batch', default=batch, metavar='FILE',
+                            help='graph the sets of segment files listed in '
+                                'this .csv file (see batch)')
+    args = parser.parse_args()
+
+    # python2 may not work with this script (untested), so print a warning
+    if six.PY2:
+        print('This program is tested with Python 3.x, and you have Python 2.x.')
+        print('This message is a warning; program continues to run.')
+        print('Refer to https://www.python.org/downloads/')
+
+    if args.batch:
+        sets = read_sets(args.batch)
+    elif args.files:
+        sets = [(args.files, args.out)]
+    else:
+        parser.error('no segment files given')
+    for fnames, out in sets:
+        if out and not saved_format(out):
+            print('Output file {} must end in {}. Exiting.'.format(
+                out, ', '.join(saved_formats)))
+            sys.exit(1)
+    if not load_genetic_map():
+        sys.exit(1)
+
+    # the sets are graphed at the same time, each in its own process
+    nworkers = workers or multiprocessing.cpu_count()
+    if nworkers == 1 or len(sets) < 2:
+        done = [graph_set(job) for job in sets]
+    else:
+        with multiprocessing.Pool(min(nworkers, len(sets)),
+                                      initializer=load_genetic_map) as pool:
+            done = pool.map(graph_set, sets, chunksize=1)
+    failed = done.count(False)
+    if failed:
+        print('Graphs not made: {}'.format(failed))
+        sys.exit(1)
+
+# sets of segment files are graphed in separate processes, which must not run
+# main() again
+if __name__ == '__main__':
+    main()
+    sys.exit(0)
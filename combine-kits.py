@@ -12,14 +12,15 @@
 # to gedmatch.
 
 # Instructions:
-# Edit the file names below, then run this script in python2 or python3.
+# Edit the file names below, then run this script in python3.
+# The package "numpy" is required; see README.md for installing it.
 
 # Edit the data files to be combined.
 # There should be at least two files listed.
 # It doesn't matter if the files are extracted or compressed.
 # In the examples given below, lines starting with '#' are ignored,
 # and these examples are for files residing in a folder called 'test-data'.
-# All data files must be based on build 37.
+# All data files must be based on build 37, or be listed in LIFTOVER below.
 INFILES = [
   'test-data/37_C_Treece_Chrom_Autoso_20170722.csv.gz',
   'test-data/genome_Carl_Treece_v5_Full_20190110124151.zip',
@@ -36,257 +37,165 @@ INFILES = [
   ]
 OUTFILE = 'combined-output.csv'
 
-#--- adjust file names above this line, then run ---
-
-import zipfile
-import csv
-import gzip
-import errno
-import io
-
-# These are used variously to indicate no allele called at the position.
-# In the combined kit, we omit these. See also https://learn.familytreedna.com/autosomal-ancestry/universal-dna-matching/read-family-finder-raw-data-file/
-NOVALUE = ('-', '--', '00', 'DD', 'II', 'I', 'D', 'DI')
-
-# resulting mash-up
-geno = {}
-
-# Put the 2-char allele pair in deterministic order.
-# e.g., the combined output considers "GT" equivalent to "TG"
-def normalize_result(result):
-    if len(result) == 1:
-        return result
-    if len(result) != 2:
-        print('BAD RESULT: {}'.format(result))
-    if result[0] > result[1]:
-        result = result[1] + result[0]
-    return result
-
-# make sure chromosome name is presented consistently
-# sometimes X results present as 'X', 'XY', '23', or '25' - always use '23'
-# sometimes MT results present as '26'
-# sometimes Y results present as '24'
-xmap = {'X': '23', '25': '23', 'XY': '23',
-        '26': 'MT',
-        '24': 'Y'}
-def normalize_chr(chrom):
-    try:
-        c = xmap[chrom]
-    except KeyError:
-        c = chrom
-    return c
-
-    
-# Take calls from multiple results and unify if possible.
-# E.g. if one company reports "--" and another company reports "GT" use "GT"
-# Handles most instances but might miss some fixable inconsistencies.
-# Input is a set of calls, one for each testing company, for a given position.
-def normalize_calls(s):
-    arr = list(s)
-    rsid = arr[0][0]    # RSID names may vary; pick any one RSID name
-    results = [r[1] for r in arr]
-    for noval in NOVALUE:
-        if noval in results:
-            results.remove(noval)
-    results.sort()      # 'A' sorts before 'AA'
-    try:
-        if results[0] * 2 == results[1]:
-            results = results[1:]
-    except:
-        pass # maybe already reduced
-
-    # after the above reductions, there's only one distinct value remaining
-    if results and results == [results[0]] * len(results):
-        return set( [(rsid,results[0])] )
-    elif not results:
-        return set() # everything was a no-call
-    return s # fail to unify results
-
-
-# guess the gender of the tester based on chr23 data
-# if there are many heterozygous calls, the kit is probably female
-# input is a list of tuples: (rsid, chromosome, position, alleles)
-def guess_gender(kit):
-    gender = 'F'
-    chr23 = [tup[3] for tup in kit if tup[1] == '23']
-    homocount = len([a for a in chr23 if len(a) == 1 or a[0] == a[1]])
-    if 1.0 * homocount/len(chr23) > .95: # arbitrary magic number
-        gender = 'M'
-    return gender
-
-# open a csv file and return the lines contained in it
-def get_filelines(f):
-    try:
-        if f.lower().endswith('.csv.gz'):
-            with gzip.open(f, 'rt') as gf:
-                lines = [l for l in gf.readlines() if not l.startswith('#')]
-        elif f.lower().endswith('.zip'):
-            with zipfile.ZipFile(f) as zf:
-                for info in zf.filelist:
-                    csvf = info.filename
-                    if csvf.lower().endswith('.txt') or csvf.lower().endswith('.csv'):
-                        break
-                with zf.open(csvf) as fname:
-                    textfile = io.TextIOWrapper(fname, encoding='utf8')
-                    lines = [str(l) for l in textfile.readlines()
-                             if not l.startswith('#')]
-        elif f.lower().endswith('.csv') or f.lower().endswith('.txt'):
-            lines = [l for l in open(f, 'r').readlines() if not l.startswith('#')]
-        else:
-            print('Skipping unrecognized file {} of type: {} - use .csv, .txt, or .zip'.format(f))
-            return None
-    except IOError as ioe:
-        if ioe.errno == errno.ENOENT:
-            print('Could not find {} - check file name and readability.'.format(f))
-            return None
-        else:
-            print('There may be a problem with {} - did not read it.'.format(f))
-            return None
-    except TypeError:
-        print('There was a problem processing {} - try unzipping it.'.format(f))
-        # raise
-        return None
-    except Exception as e:
-        print('Error "{}" happened while processing {} - continuing.'.format(e,f))
-        return None
-    return lines
-    
-# Loop through data files:
-# To support additional company data files, this loop may need to be tweaked.
-# File types currently handled:
-#   .csv, .txt: plain csv file
-#   .csv.gz: compressed csvfile
-#   .zip: zipped csvfile
-# Companies supported: AncestryDNA, FTDNA, 23andMe
-# Additional companies might work, if data format is similar.
-for f in INFILES:
-    if not f:
-        continue
-    lines = get_filelines(f)
-
-    # standardize field names and csv flavor
-    # handles either rsid,chr,pos,result or rsid,chr,pos,allele1,allele2
-    try:
-        dialect = csv.Sniffer().sniff(''.join(lines[0:10]))
-    except:
-        print('{} does not appear to contain csv data - skipping'.format(f))
-        continue
-    d = csv.DictReader(lines, dialect=dialect)
-    ncols = len(d.fieldnames)
-    if ncols not in (4,5):
-        raise ValueError('unhandled type of csv file {} with fields{}'.
-                             format(f,d.fieldnames))
-    fieldnames = ['rsid', 'chromosome', 'position']
-    if ncols == 4:
-        fieldnames.append('result')
-    else:
-        fieldnames += ['allele1', 'allele2']
-    if d.fieldnames[0].lower().strip() == 'rsid':
-        d = csv.DictReader(lines[1:], fieldnames=fieldnames, dialect=dialect)
-    else:
-        d = csv.DictReader(lines, fieldnames=fieldnames, dialect=dialect)
+# Data files of another build, e.g. build 38, can be converted to build 37 as
+# they're read: list each with a UCSC chain file for the conversion, e.g.
+# {'me-build38.txt': 'hg38ToHg19.over.chain.gz'} (see dnakit/liftover.py).
+# The positions that can't be converted are listed in a file named like the
+# data file, ending in .unmapped.csv.
+LIFTOVER = {}
+
+# To write a compressed file, end the output file name with .csv.gz or .zip.
+# Compression level, from 1 (fastest) to 9 (smallest file).
+COMPRESSLEVEL = 6
+
+# Folder for keeping already-read kits, so the next run with the same data
+# files doesn't have to read them again. Set to None to not use a cache.
+# It's safe to delete the folder at any time.
+CACHEDIR = 'kit-cache'
+
+# Number of data files to read at the same time, each in its own process.
+# Use 1 to read them one after another, or None to use all processors.
+WORKERS = None
+
+# Keep the calls of every data file next to the output file (in a folder
+# named like the output file, ending in .calls), so that a data file can later
+# be added, removed or replaced without reading the others again:
+#   combine-kits.py --add new-kit.zip
+#   combine-kits.py --remove old-kit.csv
+#   combine-kits.py --replace downloaded-again.zip
+# Each option can be given more than once. Set to False to not keep the calls.
+KEEPCALLS = True
+
+# To find out where the time goes, name a .json file here, e.g. 'combine-stages.json':
+# the time, processor time, rows and peak memory of each stage of the work are
+# written to it. Tracing the memory slows the run down. Only the stages done
+# in this process are seen in detail; use WORKERS = 1 to see them all.
+STAGEREPORT = None
+
+# With STAGEREPORT, also save a cProfile of each stage in this folder, e.g.
+# 'profiles'. They can be read with python's pstats module.
+PROFILEDIR = None
 
-    # Process each line of the input file.
-
-    # At each position discovered, add to the set of reads at that same
-    # position. Later, after all files are read, try to reduce the set down to
-    # one read at that position.
+#--- adjust file names above this line, then run ---
 
-    for tup in d:
-        chrom = normalize_chr(tup['chromosome'])
-        if chrom == '0':
-            print('Skipping {}'.format(tup))
+import argparse
+
+from dnakit.api import write_kits
+from dnakit.callstore import CallStore, read_store, write_store
+from dnakit.combine import count_results, output_blocks, unified_blocks
+from dnakit.kit import load_kits
+from dnakit.manifest import Manifest, read_manifest
+from dnakit.stages import start_recording, stage, write_report
+
+# Read the data files, returning a list of (file name, kit) for those that
+# could be read. manifest is as for load_kits.
+def read_kits(files, manifest=None):
+    # To support additional company data files, dnakit/reader.py may need to
+    # be tweaked.
+    # File types currently handled:
+    #   .csv, .txt: plain csv file
+    #   .csv.gz: compressed csvfile
+    #   .zip: zipped csvfile
+    # Companies supported: AncestryDNA, FTDNA, 23andMe
+    # Additional companies might work, if data format is similar.
+    kits = []
+    for f, kit in zip(files, load_kits(files, CACHEDIR, WORKERS, manifest,
+                                         LIFTOVER)):
+        if kit is None:
             continue
-        kv = (chrom, tup['position'])
-        if ncols==5:
-            result = tup['allele1']+tup['allele2']
+        kits.append((f, kit))
+        print('Done with {}; positions read: {}'.format(f,len(kit)))
+    return kits
+
+# Change the kept calls of an earlier run as given by the command line
+# options, reading only the added and replaced files. Returns None if there
+# are no kept calls.
+def update_store(args):
+    manifest = read_manifest(CACHEDIR) if CACHEDIR else Manifest()
+    with stage('read-calls'):
+        store = read_store(OUTFILE, manifest)
+    if store is None:
+        print('No calls kept for {} - run once without --add, --remove or '
+                  '--replace.'.format(OUTFILE))
+        return None
+    for f in args.remove:
+        if f in store.sources:
+            store.remove(f)
+            print('Removed {}'.format(f))
         else:
-            result = tup['result']
-
-        # special case for FamilyFinder (ignore embedded "X" csv header)
-        if result == 'RESULT':
-            continue
-
-        # put logically equivalent results into a deterministic result
-        # output will not be phased, no matter whether input was or not
-        result = normalize_result(result)
-
-        vv = (tup['rsid'], result)
-        try:
-            geno[kv].append(vv)
-        except:
-            geno[kv] = [vv,]
-    print('Done with {}; positions now stored: {}'.format(f,len(geno)))
-
-# Handle the positions that have more than one value.
-# This happens when more than one DNA kit has a call for the same position.
-# The different kits might have different values at those positions.
-mults = 0
-ones = 0
-nocalls = 0
-outvals = []
-for g in geno:
-    # get rid of duplicates
-    s = set(geno[g])
-    # apply some rules to fix logically equivalent calls
-    s = normalize_calls(s)
-    # if there are still multiple calls, we will not write them to output
-    if len(s) > 1:
-        mults += 1
-        # uncomment if you want to see discarded calls
-        # most discarded calls are currently MT and Y; some could be fixed
-        # print(g, s)
-    elif not s:
-        nocalls += 1
-        continue
-
-    # everything is fine with this position, so write it to the output
-    elif len(s) == 1:
-        ones += 1
-        outvals.append((list(s)[0][0], g[0], g[1], list(s)[0][1])) # r,c,p,v
-        # print(g, s)
-
-# guess the gender of this kit from the data
-gender = guess_gender(outvals)
-print('This kit seems to be {} gender'.format(gender))
-
-# sort the output by chromosome, position
-chr_order = ['1', '2', '3', '4', '5', '6', '7', '8', '9', '10', '11', '12',
-    '13', '14', '15', '16', '17', '18', '19', '20', '21', '22', '23',
-    'MT', 'Y']
-outvals.sort(key=lambda x:(chr_order.index(x[1]),int(x[2])))
-
-# write the output as a .csv file
-with open(OUTFILE, 'w') as csvfile:
-    fieldnames = ['RSID', 'CHROMOSOME', 'POSITION', 'RESULT']
-    c = csv.DictWriter(csvfile, fieldnames=fieldnames)
-    c.writeheader()
-    for r in outvals:
-        alleles = r[3]
-        chrom = r[1]
-        # for males, output only one letter, for homozygous calls
-        if chrom == '23' and gender == 'M':
-            if len(alleles) == 2 and alleles[0] != alleles[1]:
-                continue # genotype error - males do not inherit two X's
-            else:
-                alleles = alleles[0] # output, e.g. AA -> A
-        elif chrom == 'Y':
-            if gender == 'F':
-                continue # genotype error, part of Y indistinguishable from X
-            else:
-                alleles = alleles[0] # output, e.g. AA -> A
-        elif chrom == 'MT':
-            if len(alleles) == 2 and alleles[0] != alleles[1]:
-                continue # genotype error - MT must be only one value
-            else:
-                alleles = alleles[0] # output, e.g. AA -> A
-        # normal case
-        if alleles not in NOVALUE:
-            c.writerow({'RSID': r[0], 'CHROMOSOME': chrom,
-                            'POSITION': r[2], 'RESULT': alleles})
+            print('Skipping {} - not one of the combined files'.format(f))
+    add = [f for f in args.add if f not in store.sources]
+    for f in args.add:
+        if f in store.sources:
+            print('Skipping {} - already combined, use --replace'.format(f))
+    replace = [f for f in args.replace if f in store.sources]
+    for f in args.replace:
+        if f not in store.sources:
+            print('Skipping {} - not one of the combined files, use --add'.
+                      format(f))
+    for f, kit in read_kits(add + replace, manifest):
+        if f in add:
+            store.add(f, kit)
         else:
-            nocalls += 1
-
-# summarize the results
-print('Inconsistent calls not written: {}\nCombined calls: {}\nNo-calls: {}'.
-          format(mults,ones,nocalls))
+            store.replace(f, kit)
+    return store
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Combine the raw data files listed in INFILES into '
+            'OUTFILE, or change an earlier combined file (see KEEPCALLS)')
+    parser.add_argument('--add', action='append', default=[], metavar='FILE',
+                            help='add a data file to the combined file')
+    parser.add_argument('--remove', action='append', default=[],
+                            metavar='FILE',
+                            help='remove a data file from the combined file')
+    parser.add_argument('--replace', action='append', default=[],
+                            metavar='FILE',
+                            help='read a data file again, e.g. a newer download')
+    args = parser.parse_args()
+    if STAGEREPORT:
+        start_recording(profile_dir=PROFILEDIR)
+
+    # Line up all of the reads by position. At each position, there is a set
+    # of reads, one from each file that has it. The set is reduced down to one
+    # read at that position if possible.
+    # This happens when more than one DNA kit has a call for the same position.
+    # The different kits might have different values at those positions.
+    # The files are lined up a block of positions at a time, and each block
+    # is written out as soon as it's reduced. When changing an earlier
+    # combined file, only the positions of the changed files are reduced
+    # again.
+    stats, info = {}, {}
+    if args.add or args.remove or args.replace:
+        store = update_store(args)
+        if store is None:
+            return
+        count_results(store.results, stats)
+        kits = [store.kit()]
+    else:
+        store = None
+        files = read_kits([f for f in INFILES if f])
+        kept = [] if KEEPCALLS else None
+        kits = unified_blocks([kit for f, kit in files], stats, kept)
+
+    # write the output as a .csv file, sorted by chromosome, position,
+    # leaving out the genotype errors and no-calls. The gender of this kit is
+    # guessed from the data.
+    write_kits(output_blocks(kits, info), OUTFILE, COMPRESSLEVEL)
+    print('This kit seems to be {} gender ({})'.format(
+        info['gender'], info['sexcounts'].summary()))
+
+    # summarize the results
+    print('Inconsistent calls not written: {}\nCombined calls: {}\nNo-calls: {}'.
+              format(stats['mults'],stats['ones'],
+                         stats['nocalls']+info['nocalls']))
+    if KEEPCALLS:
+        if store is None:
+            store = CallStore.from_blocks([f for f, kit in files], kept)
+        with stage('save-calls'):
+            write_store(store, OUTFILE)
+    write_report(STAGEREPORT)
+
+# files are read in separate processes, which must not run main() again
+if __name__ == '__main__':
+    main()
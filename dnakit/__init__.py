@@ -0,0 +1,11 @@
+# License: GPLv3. See accompanying LICENSE file.
+# No warranty. You are responsible for your use of this program.
+
+# Purpose:
+# Shared code for the raw DNA kit tools (combine-kits.py, phase-kit.py,
+# extend-kit.py and others). The scripts in the top-level folder import from
+# here, so this folder must stay next to them.
+#
+# A program can also use the tools directly on kits in memory; see api.py,
+# match.py and cohort.py. Nothing is imported here, so that a script using
+# only the reader (merge-csv.py) doesn't need numpy.
@@ -0,0 +1,68 @@
+# License: GPLv3. See accompanying LICENSE file.
+# No warranty. You are responsible for your use of this program.
+
+# Purpose:
+# The kit tools as functions that take and return kits in memory, for running
+# several steps in one program without writing .csv files and reading them
+# again in between. For example, to combine each person's tests, extend the
+# child's kit with the parents', then phase it:
+#
+#   from dnakit.api import combine, extend, phase
+#   from dnakit.kit import load_kits
+#   kits = load_kits(['kid-23.zip', 'kid-anc.zip', 'mom-ft.csv.gz',
+#                     'mom-23.txt', 'dad-anc.zip'], 'kit-cache')
+#   child = combine(kits[0:2])
+#   mother = combine(kits[2:4])
+#   father = kits[4]
+#   child = extend(child, mother, father)
+#   phase(child, mother, father).write('phased.csv')
+#
+# Each data file is read only once. The kit each step returns is the kit that
+# reading the tool's output file would give, so a chain of steps gives the
+# same results as running the scripts one after another.
+
+from dnakit.combine import FIELDNAMES, combine_kits, output_calls
+from dnakit.extend import extended_output
+from dnakit.phase import phase_trio
+from dnakit.writer import write_csv, write_csv_blocks
+
+# The combined kit of several kits of one person, as combine-kits.py writes
+# it. Kits that are None (files that couldn't be read) are left out. If stats
+# is given, it gets the counts combine-kits.py reports: 'mults' inconsistent
+# calls, 'ones' combined calls, 'nocalls' no-calls.
+def combine(kits, stats=None):
+    if stats is None:
+        stats = {}
+    kit = combine_kits([k for k in kits if k is not None], stats)
+    kit, nocalls = output_calls(kit, kit.guess_gender())
+    stats['nocalls'] += nocalls
+    return kit
+
+# The child's kit extended with values deduced from the parents' kits, as
+# extend-kit.py writes it. gender is the child's, 'M' or 'F'; by default it's
+# guessed from the child's kit.
+def extend(childkit, motherkit, fatherkit, gender=None):
+    kits = [k.unique() for k in (childkit, motherkit, fatherkit)]
+    return extended_output(*kits, gender or kits[0].guess_gender())[0]
+
+# The child's kit phased with the parents' kits, as a phase.Phased, which has
+# the values phase-kit.py writes, and can write them. gender is as for
+# extend.
+def phase(childkit, motherkit, fatherkit, gender=None):
+    kits = [k.unique() for k in (childkit, motherkit, fatherkit)]
+    return phase_trio(*kits, gender or kits[0].guess_gender())
+
+# Write a kit as a .csv file in the format combine-kits.py and extend-kit.py
+# write, which can be uploaded to a matching service. A name ending in
+# .csv.gz or .zip is written compressed, at the given level.
+def write_kit(kit, f, level=6):
+    write_csv(f, FIELDNAMES, kit_columns(kit), level)
+
+# Write kits one after another as one file, as write_kit does. kits may be a
+# generator, so that each kit is written as soon as it's made.
+def write_kits(kits, f, level=6):
+    write_csv_blocks(f, FIELDNAMES, (kit_columns(kit) for kit in kits), level)
+
+# the columns of the output file for a kit
+def kit_columns(kit):
+    return [kit.rsid_names(), kit.chromosomes(), kit.pos, kit.genotypes()]
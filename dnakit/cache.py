@@ -0,0 +1,130 @@
+# License: GPLv3. See accompanying LICENSE file.
+# No warranty. You are responsible for your use of this program.
+
+# Purpose:
+# Keep a copy of each kit that has been read, already converted to arrays, so
+# the next run can skip decompressing and parsing the raw data file. Each
+# cached kit is a folder of .npy files that are memory-mapped when loaded.
+#
+# The cache folder is named in the settings of each script. A cached kit is
+# used only if the raw data file has the same size and modification time as
+# when it was cached; otherwise the file is read again and the cache updated.
+# Cached kits refer to rsid names by their index in the SNP manifest kept in
+# the same folder (see manifest.py), so a cached kit is also only used with
+# the manifest it was saved with.
+# It's always safe to delete the cache folder.
+
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+
+import numpy as np
+
+# bump this when the arrays stored in the cache change
+CACHE_VERSION = 3
+
+# the arrays that make up a kit, apart from the manifest's rsid names, and
+# the kit's SexCounts
+FIELDS = ('chrom', 'pos', 'geno', 'rsid', 'sexcounts')
+
+# the folder in the cache for a raw data file
+def cache_path(f, cachedir):
+    key = hashlib.sha1(os.path.abspath(f).encode('utf8')).hexdigest()
+    return os.path.join(cachedir, key)
+
+# what identifies the raw data file, and the manifest, as unchanged
+def source_info(f, serial):
+    st = os.stat(f)
+    return {'version': CACHE_VERSION, 'source': os.path.abspath(f),
+            'size': st.st_size, 'mtime': st.st_mtime_ns, 'manifest': serial}
+
+# Return a dictionary of arrays for a cached kit, or None if the kit isn't
+# cached, or the raw data file changed since it was cached, or it was cached
+# with a manifest whose serial is not one of serials (see Manifest.serials).
+# Arrays are mapped copy-on-write, so changing them in memory never touches
+# the cache.
+def read_cached(f, cachedir, serials):
+    path = cache_path(f, cachedir)
+    try:
+        with open(os.path.join(path, 'source.json')) as jf:
+            info = json.load(jf)
+        if info.get('manifest') not in serials:
+            return None
+        if info != source_info(f, info['manifest']):
+            return None
+        return {k: np.load(os.path.join(path, k + '.npy'), mmap_mode='c')
+                    for k in FIELDS}
+    except (IOError, OSError, ValueError):
+        return None
+
+# Save the arrays of a kit read from f, whose rsids refer to the manifest
+# with the given serial. The folder is written under a temporary name first,
+# so an interrupted run never leaves a partial entry.
+def write_cached(f, cachedir, arrays, serial):
+    tmp = None
+    try:
+        info = source_info(f, serial)
+        os.makedirs(cachedir, exist_ok=True)
+        tmp = tempfile.mkdtemp(dir=cachedir)
+        for k in FIELDS:
+            np.save(os.path.join(tmp, k + '.npy'), arrays[k])
+        with open(os.path.join(tmp, 'source.json'), 'w') as jf:
+            json.dump(info, jf)
+        path = cache_path(f, cachedir)
+        shutil.rmtree(path, ignore_errors=True)
+        os.rename(tmp, path)
+    except (IOError, OSError) as e:
+        print('Could not save {} in cache {}: {}'.format(f, cachedir, e))
+        if tmp:
+            shutil.rmtree(tmp, ignore_errors=True)
+
+# The folder in the cache for something other than a kit read from file or
+# folder f, such as a genetic map or a chain file; kind tells them apart.
+def named_cache_path(kind, f, cachedir):
+    key = hashlib.sha1(os.path.abspath(f).encode('utf8')).hexdigest()
+    return os.path.join(cachedir, '{}-{}'.format(kind, key))
+
+# what identifies files as unchanged: the name, size and modification time of
+# each
+def files_info(files):
+    info = []
+    for f in files:
+        st = os.stat(f)
+        info.append([os.path.abspath(f), st.st_size, st.st_mtime_ns])
+    return info
+
+# Return a dictionary of the arrays named by fields, kept in the cache folder
+# path by write_cached_arrays, or None if they aren't there or were kept with
+# other info, e.g. because the files they were read from changed. Arrays are
+# mapped read-only.
+def read_cached_arrays(path, info, fields):
+    try:
+        with open(os.path.join(path, 'source.json')) as jf:
+            if json.load(jf) != info:
+                return None
+        return {k: np.load(os.path.join(path, k + '.npy'), mmap_mode='r')
+                    for k in fields}
+    except (IOError, OSError, ValueError):
+        return None
+
+# Keep a dictionary of arrays in the cache folder path, in cachedir, with info
+# saying what they were read from. As for kits, it's written under a
+# temporary name first. what names the arrays in the message if they can't
+# be saved.
+def write_cached_arrays(path, cachedir, arrays, info, what):
+    tmp = None
+    try:
+        os.makedirs(cachedir, exist_ok=True)
+        tmp = tempfile.mkdtemp(dir=cachedir)
+        for k, v in arrays.items():
+            np.save(os.path.join(tmp, k + '.npy'), v)
+        with open(os.path.join(tmp, 'source.json'), 'w') as jf:
+            json.dump(info, jf)
+        shutil.rmtree(path, ignore_errors=True)
+        os.rename(tmp, path)
+    except (IOError, OSError) as e:
+        print('Could not save {} in cache {}: {}'.format(what, cachedir, e))
+        if tmp:
+            shutil.rmtree(tmp, ignore_errors=True)
@@ -0,0 +1,187 @@
+# License: GPLv3. See accompanying LICENSE file.
+# No warranty. You are responsible for your use of this program.
+
+# Purpose:
+# Keep the calls of every kit that went into a combined kit, next to the
+# combined output file, so that a kit can later be added, removed or replaced
+# by reading only that kit's file. The store is a folder named after the
+# output file, ending in .calls, holding:
+#   - every call of every kit, with the kit it came from, sorted by position
+#   - the unified result at every position (see combine.unify_calls)
+# Changing a kit unifies again only the positions that kit has.
+
+import json
+import os
+import shutil
+import tempfile
+
+import numpy as np
+
+from dnakit.combine import unified_blocks, unify_calls, unified_kit
+from dnakit.kit import Kit
+from dnakit.stages import stage
+
+# bump this when the arrays stored change
+STORE_VERSION = 1
+
+# the arrays of the calls, and of the unified results
+FIELDS = ('chrom', 'pos', 'geno', 'rsid', 'source', 'keys', 'results',
+          'result_rsid')
+
+
+class CallStore(object):
+
+    # calls: a Kit with the calls of all kits, sorted by position, then by
+    #   the order the kits are listed in
+    # source: for each call, the index in sources of the kit it came from
+    # sources: the file names of the kits
+    # keys, results, rsid: the unified result at each position, as returned
+    #   by unify_calls
+    def __init__(self, calls, source, sources, keys, results, rsid):
+        self.calls = calls
+        self.source = source
+        self.sources = sources
+        self.keys = keys
+        self.results = results
+        self.rsid = rsid
+
+    # A store of the calls of kits read from files, all of them unified.
+    @staticmethod
+    def from_kits(files, kits):
+        kept = []
+        for block in unified_blocks(kits, {}, kept):
+            pass
+        return CallStore.from_blocks(files, kept)
+
+    # A store of the blocks kept by combine.unified_blocks for the kits read
+    # from files. The blocks are in position order, so they are only put
+    # together, not sorted again.
+    @staticmethod
+    def from_blocks(files, kept):
+        if not kept:
+            return CallStore(Kit.empty(), np.zeros(0, dtype=np.uint16),
+                                 list(files), np.zeros(0, dtype=np.uint64),
+                                 np.zeros(0, dtype=np.uint8),
+                                 np.zeros(0, dtype=np.uint32))
+        calls, source, keys, results, rsid = zip(*kept)
+        return CallStore(Kit.concatenate(calls), np.concatenate(source),
+                             list(files), np.concatenate(keys),
+                             np.concatenate(results), np.concatenate(rsid))
+
+    # the unified kit (see combine.unified_kit)
+    def kit(self):
+        return unified_kit(self.keys, self.results, self.rsid,
+                               self.calls.rsids)
+
+    # Put the calls of kit into the store, as coming from sources[index]. The
+    # kit's rsids must refer to the same table of names as the store's, or a
+    # larger one that grew from it (see Manifest).
+    def insert(self, kit, index):
+        old = self.calls
+        calls = Kit.concatenate([Kit(old.chrom, old.pos, old.geno, old.rsid,
+                                         kit.rsids), kit])
+        source = np.concatenate([self.source,
+                                     np.full(len(kit), index, np.uint16)])
+        with stage('sort'):
+            order = np.lexsort((source, calls.keys()))
+        self.calls = calls.take(order)
+        self.source = source[order]
+
+    # Take out the calls of sources[index], returning their positions.
+    def delete(self, index):
+        mine = self.source == index
+        keys = self.calls.keys()[mine]
+        self.calls = self.calls.take(~mine)
+        self.source = self.source[~mine]
+        return keys
+
+    # Unify again the calls at the given positions.
+    def update(self, keys):
+        keys = np.unique(keys)
+        if not len(keys):
+            return
+        with stage('unify') as s:
+            calls = self.calls.take(np.isin(self.calls.keys(), keys))
+            k, results, rsid = unify_calls(calls)
+            keep = ~np.isin(self.keys, keys)
+            allkeys = np.concatenate([self.keys[keep], k])
+            with stage('sort'):
+                order = np.argsort(allkeys, kind='stable')
+            self.keys = allkeys[order]
+            self.results = np.concatenate([self.results[keep], results])[order]
+            self.rsid = np.concatenate([self.rsid[keep], rsid])[order]
+            s.rows += len(calls)
+
+    # Add a kit read from file f, listed after the others.
+    def add(self, f, kit):
+        self.sources.append(f)
+        self.insert(kit, len(self.sources) - 1)
+        self.update(kit.keys())
+
+    # Remove the kit read from file f.
+    def remove(self, f):
+        index = self.sources.index(f)
+        keys = self.delete(index)
+        self.source[self.source > index] -= 1
+        del self.sources[index]
+        self.update(keys)
+
+    # Replace the kit read from file f with kit, keeping its place in the list.
+    def replace(self, f, kit):
+        index = self.sources.index(f)
+        keys = self.delete(index)
+        self.insert(kit, index)
+        self.update(np.concatenate([keys, kit.keys()]))
+
+
+# the folder of the store kept for an output file
+def store_path(outfile):
+    return outfile + '.calls'
+
+# Return the store kept for an output file, or None if there is none or it
+# can't be read. The rsids of the store are put into manifest, and refer to
+# its names.
+def read_store(outfile, manifest):
+    path = store_path(outfile)
+    try:
+        with open(os.path.join(path, 'store.json')) as jf:
+            info = json.load(jf)
+        if info['version'] != STORE_VERSION:
+            return None
+        a = {k: np.load(os.path.join(path, k + '.npy')) for k in FIELDS}
+        names = manifest.intern(np.load(os.path.join(path, 'names.npy')))
+    except (IOError, OSError, ValueError, KeyError):
+        return None
+    calls = Kit(a['chrom'], a['pos'], a['geno'], names[a['rsid']],
+                    manifest.names)
+    return CallStore(calls, a['source'], info['sources'], a['keys'],
+                         a['results'], names[a['result_rsid']])
+
+# Save the store for an output file. Only the rsid names it uses are saved
+# with it. It's written under a temporary name first, as for cached kits.
+def write_store(store, outfile):
+    path = store_path(outfile)
+    used, inv = np.unique(np.concatenate([store.calls.rsid, store.rsid]),
+                              return_inverse=True)
+    ncalls = len(store.calls)
+    arrays = {'chrom': store.calls.chrom, 'pos': store.calls.pos,
+              'geno': store.calls.geno,
+              'rsid': inv[:ncalls].astype(np.uint32),
+              'source': store.source, 'keys': store.keys,
+              'results': store.results,
+              'result_rsid': inv[ncalls:].astype(np.uint32),
+              'names': store.calls.rsids[used]}
+    tmp = None
+    try:
+        tmp = tempfile.mkdtemp(dir=os.path.dirname(os.path.abspath(path)))
+        for k, v in arrays.items():
+            np.save(os.path.join(tmp, k + '.npy'), v)
+        with open(os.path.join(tmp, 'store.json'), 'w') as jf:
+            json.dump({'version': STORE_VERSION, 'sources': store.sources},
+                      jf)
+        shutil.rmtree(path, ignore_errors=True)
+        os.rename(tmp, path)
+    except (IOError, OSError) as e:
+        print('Could not save the calls in {}: {}'.format(path, e))
+        if tmp:
+            shutil.rmtree(tmp, ignore_errors=True)
@@ -0,0 +1,246 @@
+# License: GPLv3. See accompanying LICENSE file.
+# No warranty. You are responsible for your use of this program.
+
+# Purpose:
+# Many kits packed as bits, for comparing one kit with hundreds of others
+# (see scan-kits.py) without keeping hundreds of kits in memory. The kits of
+# a cohort are laid over one table of positions: those of chromosomes 1-22
+# and X in the SNP manifest (see manifest.py), which has every position of
+# every kit read. Each kit has a plane of one bit per position for:
+#   called: the kit has a call there
+#   A, C, G, T: the kit is homozygous for that allele there (a single
+#     allele, as in a male's X, counts too)
+# packed 64 to a word, so a kit of 700,000 SNPs takes about 400 KB.
+# Two kits are opposite homozygotes where both are homozygous, but not for
+# the same allele, which takes a few logical operations for 64 positions at
+# once. The runs between opposite homozygotes are the half-identical
+# segments, as match.match_kits finds them, and the SNPs both kits have
+# called in each run are counted by counting the bits set in the words.
+
+import multiprocessing
+import shutil
+import tempfile
+
+import numpy as np
+
+from dnakit.genotype import GENO_CODE, IS_HOMO, IS_NOVALUE
+from dnakit.kit import CHR23, load_kits
+from dnakit.manifest import read_manifest
+from dnakit.match import Segments
+from dnakit.stages import stage
+
+# the planes of each kit: called, then one for each homozygous allele
+PLANES = 'ACGT'
+NPLANES = 1 + len(PLANES)
+
+# for each genotype code, the plane of the allele it's homozygous for, or 0
+# (the called plane) if it's not a homozygous call
+HOMO_PLANE = np.zeros(256, dtype=np.uint8)
+for g, i in GENO_CODE.items():
+    if IS_HOMO[i] and not IS_NOVALUE[i] and g[0] in PLANES:
+        HOMO_PLANE[i] = 1 + PLANES.index(g[0])
+
+# Default number of data files read at once when packing a cohort; only
+# these are in memory as kits at the same time.
+BATCH = 32
+
+# the number of bits set in each word of an array of 64-bit words
+if hasattr(np, 'bitwise_count'):
+    def popcount(words):
+        return np.bitwise_count(words)
+else:
+    # numpy before 2.0: count the bits of each byte from a table
+    BYTE_BITS = np.array([bin(i).count('1') for i in range(256)],
+                         dtype=np.uint8)
+    def popcount(words):
+        return BYTE_BITS[words.view(np.uint8)].reshape(-1, 8).sum(axis=1)
+
+# the bits of words, one row of 64 per word, lowest bit first
+def unpack_words(words):
+    return np.unpackbits(words.view(np.uint8).reshape(-1, 8), axis=1,
+                             bitorder='little')
+
+# the indexes of the bits set in words, in order
+def set_bits(words):
+    nz = np.flatnonzero(words)
+    row, bit = np.nonzero(unpack_words(words[nz]))
+    return nz[row] * 64 + bit
+
+# For each bit index in x, the number of bits set in words below it. cum has
+# the number of bits set in the words before each word, and one more total.
+def rank(words, cum, x):
+    w = x >> 6
+    words = np.append(words, np.zeros(1, words.dtype))
+    below = np.left_shift(np.uint64(1), (x & 63).astype(np.uint64)) - \
+        np.uint64(1)
+    return cum[w] + popcount(words[w] & below)
+
+# For each count r in rs, the index of the bit set in words that has r bits
+# set below it. cum is as for rank.
+def select(words, cum, rs):
+    w = np.searchsorted(cum, rs, side='right') - 1
+    within = (rs - cum[w])[:, None]
+    bit = np.argmax(np.cumsum(unpack_words(words[w]), axis=1) > within,
+                        axis=1)
+    return w * 64 + bit
+
+# The planes of a kit over a table of positions (see Kit.keys), as an array
+# of (NPLANES, nwords) words. Positions of the kit not in keys are left out.
+def pack_kit(kit, keys, nwords):
+    kit = kit.unique()
+    kit = kit.take(~IS_NOVALUE[kit.geno])
+    kkeys = kit.keys()
+    idx = np.searchsorted(keys, kkeys)
+    found = idx < len(keys)
+    found[found] = keys[idx[found]] == kkeys[found]
+    idx = idx[found]
+    plane = HOMO_PLANE[kit.geno[found]]
+    bits = np.zeros((NPLANES, nwords * 64), dtype=bool)
+    bits[0, idx] = True
+    homo = plane > 0
+    bits[plane[homo], idx[homo]] = True
+    return np.packbits(bits, axis=1, bitorder='little').view('<u8')
+
+# the number of words for n bits
+def word_count(n):
+    return (n + 63) // 64
+
+# The half-identical segments of two kits, from their planes, over the
+# positions keys, as match.match_kits returns them.
+def compare_planes(q, k, keys, min_snps, min_bp):
+    homq = q[1] | q[2] | q[3] | q[4]
+    homk = k[1] | k[2] | k[3] | k[4]
+    same = (q[1] & k[1]) | (q[2] & k[2]) | (q[3] & k[3]) | (q[4] & k[4])
+    opposite = homq & homk & ~same
+    common = q[0] & k[0]
+    cum = np.zeros(len(common) + 1, dtype=np.int64)
+    np.cumsum(popcount(common), out=cum[1:])
+
+    # the runs between opposite homozygotes, not crossing from one
+    # chromosome to the next: each starts at the start of a chromosome or
+    # after an opposite homozygote, and ends at the next of either
+    breaks = set_bits(opposite)
+    bounds = np.searchsorted(keys, np.arange(CHR23 + 2, dtype=np.uint64) <<
+                                 np.uint64(32))
+    starts = np.sort(np.concatenate([bounds[:-1], breaks + 1]))
+    ends = np.sort(np.concatenate([breaks, bounds[1:]]))
+    first = rank(common, cum, starts)
+    last = rank(common, cum, ends)
+    snps = last - first
+    keep = snps >= max(min_snps, 1)
+    lo = keys[select(common, cum, first[keep])]
+    hi = keys[select(common, cum, last[keep] - 1)]
+    mask = np.uint64(0xffffffff)
+    segments = Segments((lo >> np.uint64(32)).astype(np.uint8),
+                        (lo & mask).astype(np.uint32),
+                        (hi & mask).astype(np.uint32), snps[keep])
+    return (segments.longer(min_snps, min_bp), int(cum[-1]),
+            int(popcount(opposite).sum()))
+
+
+class Cohort(object):
+
+    # keys: the positions, sorted (see Kit.keys)
+    # names: the names of the kits, usually their file names
+    # planes: the bits of the kits, an array of (kits, NPLANES, words)
+    def __init__(self, keys, names, planes):
+        self.keys = keys
+        self.names = names
+        self.planes = planes
+
+    def __len__(self):
+        return len(self.names)
+
+    # the planes of a kit over the cohort's positions
+    def pack(self, kit):
+        return pack_kit(kit, self.keys, self.planes.shape[2])
+
+    # A cohort of kits in memory, over the positions they have.
+    @staticmethod
+    def from_kits(names, kits):
+        keys = np.unique(np.concatenate(
+            [k.keys()[k.chrom <= CHR23] for k in kits] +
+            [np.zeros(0, np.uint64)]))
+        cohort = Cohort(keys, list(names),
+                        np.zeros((len(kits), NPLANES, word_count(len(keys))),
+                                 dtype='<u8'))
+        with stage('pack') as s:
+            for i, kit in enumerate(kits):
+                cohort.planes[i] = cohort.pack(kit)
+                s.rows += len(kit)
+        return cohort
+
+    # A cohort of the kits read from files, batch files at a time (see
+    # kit.load_kits for cachedir, workers and liftover). The files are read twice:
+    # first to put all of their positions into the manifest, then to pack
+    # them; the second time they come from the cache folder, which is a
+    # temporary one if cachedir is None. Files that can't be read are left
+    # out. Returns the cohort and the manifest, for reading more kits.
+    @staticmethod
+    def from_files(files, cachedir=None, workers=1, batch=BATCH,
+                   liftover=None):
+        tmp = None
+        if not cachedir:
+            tmp = cachedir = tempfile.mkdtemp(prefix='cohort-cache-')
+        try:
+            manifest = read_manifest(cachedir)
+            batches = [files[i:i + batch] for i in range(0, len(files), batch)]
+            for b in batches:
+                load_kits(b, cachedir, workers, manifest, liftover)
+            keys = manifest.keys[manifest.keys < np.uint64(CHR23 + 1) <<
+                                     np.uint64(32)]
+            planes = np.zeros((len(files), NPLANES, word_count(len(keys))),
+                              dtype='<u8')
+            read = []
+            for b in batches:
+                kits = load_kits(b, cachedir, workers, manifest, liftover)
+                with stage('pack') as s:
+                    for f, kit in zip(b, kits):
+                        if kit is None:
+                            continue
+                        planes[len(read)] = pack_kit(kit, keys,
+                                                         planes.shape[2])
+                        read.append(f)
+                        s.rows += len(kit)
+        finally:
+            if tmp:
+                shutil.rmtree(tmp, ignore_errors=True)
+        return Cohort(keys, read, planes[:len(read)]), manifest
+
+
+# the cohort being scanned, the planes of the kit compared with it, and the
+# shortest segment, in a worker process
+shared_scan = None
+
+# set the scan in a worker process
+def share_scan(scan):
+    global shared_scan
+    shared_scan = scan
+
+# compare_planes for the kit compared and kit i of the cohort
+def scan_part(i):
+    cohort, query, min_snps, min_bp = shared_scan
+    return compare_planes(query, cohort.planes[i], cohort.keys, min_snps,
+                              min_bp)
+
+# Compare kit with every kit of the cohort. Returns a list with (Segments,
+# positions compared, opposite homozygotes) for each kit of the cohort, as
+# match.match_kits returns them. With more than one worker, the kits are
+# compared in separate processes; workers=None uses one process per
+# processor.
+def scan_cohort(cohort, kit, min_snps, min_bp, workers=1):
+    scan = (cohort, cohort.pack(kit), min_snps, min_bp)
+    with stage('scan') as s:
+        if workers == 1 or len(cohort) < 2:
+            share_scan(scan)
+            results = [scan_part(i) for i in range(len(cohort))]
+        else:
+            if workers is None:
+                workers = multiprocessing.cpu_count()
+            with multiprocessing.Pool(workers, initializer=share_scan,
+                                      initargs=(scan,)) as pool:
+                results = pool.map(scan_part, range(len(cohort)),
+                                       chunksize=max(1, len(cohort) //
+                                                         (workers * 4)))
+        s.rows += len(cohort)
+    return results
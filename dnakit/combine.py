@@ -0,0 +1,250 @@
+# License: GPLv3. See accompanying LICENSE file.
+# No warranty. You are responsible for your use of this program.
+
+# Purpose:
+# Combine the calls of several kits for the same person into one set of calls,
+# for combine-kits.py. The kits are walked together in chromosome, position
+# order, like merging sorted lists, a block of positions at a time. The rules
+# for unifying the calls at a position are applied to every position of a
+# block at once with array operations, using tables made in advance for the
+# small set of genotype codes. Only a block of calls of each kit is worked on
+# at a time, so working memory doesn't grow with the number of positions.
+
+import numpy as np
+
+from dnakit.genotype import ALLELES, GENO_CODE, FIRST, IS_HET, IS_NOVALUE
+from dnakit.kit import Kit, CHR23, CHRMT, CHRY
+from dnakit.stages import stage
+
+# the columns of the combined output file
+FIELDNAMES = ['RSID', 'CHROMOSOME', 'POSITION', 'RESULT']
+
+# number of calls of each kit taken into a block at a time
+BLOCKSIZE = 65536
+
+# Put the 2-char allele pair in deterministic order.
+# e.g., the combined output considers "GT" equivalent to "TG"
+def normalize_result(result):
+    if len(result) == 1:
+        return result
+    if len(result) != 2:
+        print('BAD RESULT: {}'.format(result))
+    if result[0] > result[1]:
+        result = result[1] + result[0]
+    return result
+
+# for each genotype code, the code of its normalize_result
+CANON = np.zeros(256, dtype=np.uint8)
+for g, i in GENO_CODE.items():
+    CANON[i] = GENO_CODE[normalize_result(g)]
+
+# Unifying two different normalized results: a single allele and the pair of
+# that allele unify to the pair, e.g. "A" and "AA" to "AA". Anything else is
+# a conflict.
+CONFLICT = 255
+UNIFY = np.full((256, 256), CONFLICT, dtype=np.uint8)
+for a in ALLELES:
+    UNIFY[GENO_CODE[a], GENO_CODE[a + a]] = GENO_CODE[a + a]
+    UNIFY[GENO_CODE[a + a], GENO_CODE[a]] = GENO_CODE[a + a]
+
+# the result of a position where all of the calls were no-calls
+NOCALL = 254
+
+# Take calls from multiple results and unify if possible.
+# E.g. if one company reports "--" and another company reports "GT" use "GT"
+# Handles most instances but might miss some fixable inconsistencies.
+# The calls at a position are the distinct (rsid, result) pairs found there in
+# all of the kits. One instance of each no-call result is set aside. What is
+# left unifies if it's all one result, or a single allele seen once together
+# with the pair of that allele ("A" and "AA" give "AA"). Nothing left at all
+# means the position is a no-call.
+#
+# kit holds the calls of all of the kits, at each position in the order the
+# kits are listed in, with rsids that refer to one table of names (see
+# merged_blocks).
+# Returns arrays for every position, in chromosome, position order: keys (see
+# Kit.keys), results (genotype codes, or CONFLICT or NOCALL), and the rsid
+# of the first call at the position, which is from the first kit listed that
+# has it. RSID names may vary between kits; the first kit's name is used.
+def unify_calls(kit):
+    keys = kit.keys()
+    code = CANON[kit.geno]
+    with stage('sort'):
+        order = np.lexsort((code, keys))
+    k = keys[order]
+    g = code[order]
+    n = len(k)
+    if not n:
+        return k, g, kit.rsid
+
+    # groups of calls with the same position and result
+    start = np.ones(n, dtype=bool)
+    start[1:] = (k[1:] != k[:-1]) | (g[1:] != g[:-1])
+    first = np.flatnonzero(start)
+    group = np.cumsum(start) - 1
+
+    # get rid of duplicates: the number of distinct rsids in each group.
+    # rsids nearly always agree, so only groups with differing rsids are
+    # counted one at a time.
+    count = np.ones(len(first), dtype=np.int64)
+    rsids = kit.rsid[order]
+    ends = np.append(first[1:], n)
+    for i in np.unique(group[rsids != rsids[first][group]]).tolist():
+        count[i] = len(set(rsids[first[i]:ends[i]].tolist()))
+
+    # set aside one instance of each no-call result
+    gk = k[first]
+    gc = g[first]
+    count -= IS_NOVALUE[gc]
+    live = np.flatnonzero(count > 0)
+
+    # the groups left at each position: the first two, and how many
+    lk = gk[live]
+    lstart = np.ones(len(live), dtype=bool)
+    lstart[1:] = lk[1:] != lk[:-1]
+    heads = np.flatnonzero(lstart)
+    ngroups = np.diff(np.append(heads, len(live)))
+    a = live[heads]
+    result = gc[a]
+    two = ngroups == 2
+    b = live[heads[two] + 1]
+    a2 = a[two]
+    u = UNIFY[gc[a2], gc[b]]
+    # the single allele must have been seen once
+    ok = (((u == gc[a2]) & (count[b] == 1)) |
+          ((u == gc[b]) & (count[a2] == 1)))
+    result[two] = np.where(ok, u, CONFLICT)
+    result[ngroups > 2] = CONFLICT
+
+    # every position, with the rsid of the first call read there
+    kstart = np.ones(n, dtype=bool)
+    kstart[1:] = k[1:] != k[:-1]
+    krows = np.flatnonzero(kstart)
+    results = np.full(len(krows), NOCALL, dtype=np.uint8)
+    results[np.searchsorted(k[krows], lk[heads])] = result
+    rsid = kit.rsid[np.minimum.reduceat(order, krows)]
+    return k[krows], results, rsid
+
+# Add the counts of the results of unify_calls to stats: 'ones' unified,
+# 'mults' inconsistent calls that could not be unified, 'nocalls' only
+# no-calls.
+def count_results(results, stats):
+    mults = int((results == CONFLICT).sum())
+    nocalls = int((results == NOCALL).sum())
+    for k, n in (('mults', mults), ('nocalls', nocalls),
+                 ('ones', len(results) - mults - nocalls)):
+        stats[k] = stats.get(k, 0) + n
+
+# A Kit of the positions that unified, from the results of unify_calls.
+def unified_kit(keys, results, rsid, rsids):
+    good = results < NOCALL
+    keys = keys[good]
+    return Kit((keys >> np.uint64(32)).astype(np.uint8),
+               (keys & np.uint64(0xffffffff)).astype(np.uint32),
+               results[good], rsid[good], rsids)
+
+# Merge the calls of kits, a block of positions at a time. Generates
+# (calls, source) for each block: calls is a Kit of the calls of all of the
+# kits at the positions of the block, sorted by position, then by the order
+# the kits are listed in, with rsids that refer to one table of names; source
+# gives for each call the index of the kit it came from. All of the calls of
+# a position are in one block, and the blocks come in chromosome, position
+# order. About blocksize calls of each kit are taken into a block, more only
+# where a kit has more calls than that at one position.
+def merged_blocks(kits, blocksize=BLOCKSIZE):
+    kits = Kit.shared_names([kit.sorted() for kit in kits])
+    offsets = [0] * len(kits)
+    size = blocksize
+    while True:
+        live = [i for i, kit in enumerate(kits) if offsets[i] < len(kit)]
+        if not live:
+            return
+        windows = [kits[i].take(slice(offsets[i], offsets[i] + size))
+                       for i in live]
+        keys = [w.keys() for w in windows]
+        # a window that stops short of the end of its kit may have more calls
+        # at its last position; the positions before the first such last
+        # position are complete
+        ends = [k[-1] for i, k in zip(live, keys)
+                    if offsets[i] + size < len(kits[i])]
+        counts = [int(np.searchsorted(k, min(ends))) if ends else len(k)
+                      for k in keys]
+        if not any(counts):
+            size *= 2
+            continue
+        size = blocksize
+        parts, sources = [], []
+        for i, w, n in zip(live, windows, counts):
+            parts.append(w.take(slice(0, n)))
+            sources.append(np.full(n, i, dtype=np.uint16))
+            offsets[i] += n
+        calls = Kit.concatenate(parts)
+        with stage('sort'):
+            order = np.argsort(calls.keys(), kind='stable')
+        yield calls.take(order), np.concatenate(sources)[order]
+
+# Generate a Kit for each block of merged_blocks, with the unified call at
+# every position of the block where the calls of the kits can be unified, in
+# chromosome, position order. stats counts the positions as in count_results.
+# If kept is a list, (calls, source, keys, results, rsid) is appended to it
+# for each block, as from merged_blocks and unify_calls.
+def unified_blocks(kits, stats, kept=None):
+    for k in ('ones', 'mults', 'nocalls'):
+        stats.setdefault(k, 0)
+    for calls, source in merged_blocks(kits):
+        with stage('unify') as s:
+            keys, results, rsid = unify_calls(calls)
+            count_results(results, stats)
+            s.rows += len(calls)
+        if kept is not None:
+            kept.append((calls, source, keys, results, rsid))
+        yield unified_kit(keys, results, rsid, calls.rsids)
+
+# Return a Kit with the unified call at every position where the calls of the
+# kits can be unified, in chromosome, position order.
+# stats counts the positions as in count_results.
+def combine_kits(kits, stats):
+    blocks = list(unified_blocks(kits, stats))
+    return Kit.concatenate(blocks) if blocks else Kit.empty()
+
+# Apply the output rules to a combined kit of the given gender, returning the
+# kit of the calls to write, and the number of no-calls left out.
+# For males, output only one letter, for homozygous calls.
+# Genotype errors are not written: males do not inherit two X's, part of Y
+# is indistinguishable from X for females, MT must be only one value.
+def output_calls(kit, gender):
+    male = gender == 'M'
+    chr23 = kit.chrom == CHR23
+    chrY = kit.chrom == CHRY
+    chrMT = kit.chrom == CHRMT
+    het = IS_HET[kit.geno]
+    errors = (chr23 & het & male) | (chrY & (not male)) | (chrMT & het)
+    one = (chr23 & male) | chrY | chrMT
+    kit.geno = np.where(one, FIRST[kit.geno], kit.geno)
+    nocalls = IS_NOVALUE[kit.geno] & ~errors
+    return kit.take(~errors & ~nocalls), int(nocalls.sum())
+
+# Apply the output rules to combined kits given one after another, in
+# chromosome, position order, generating the kit of the calls to write for
+# each (see output_calls). The rules for chr23, MT and Y depend on the gender,
+# which is guessed from those calls, so they are held back and given last, in
+# one kit. info gets the 'gender', the SexCounts it was guessed from
+# ('sexcounts'), and the number of no-calls left out ('nocalls').
+def output_blocks(kits, info):
+    info['nocalls'] = 0
+    held = []
+    for kit in kits:
+        sex = kit.chrom >= CHR23
+        held.append(kit.take(sex))
+        with stage('rules'):
+            kit, nocalls = output_calls(kit.take(~sex), None)
+        info['nocalls'] += nocalls
+        yield kit
+    kit = Kit.concatenate(held) if held else Kit.empty()
+    with stage('gender'):
+        info['gender'] = kit.guess_gender()
+    info['sexcounts'] = kit.sex_counts()
+    with stage('rules'):
+        kit, nocalls = output_calls(kit, info['gender'])
+    info['nocalls'] += nocalls
+    yield kit
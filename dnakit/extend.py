@@ -0,0 +1,108 @@
+# License: GPLv3. See accompanying LICENSE file.
+# No warranty. You are responsible for your use of this program.
+
+# Purpose:
+# Extend a child's kit with values deduced from both parents' kits, for
+# extend-kit.py. The three kits are lined up on the mother's positions once,
+# and the rules for deducing the child's value are applied to all positions
+# at once, as masks over the genotype codes.
+
+import numpy as np
+
+from dnakit.genotype import (GENOTYPES, GENO_CODE, BADGENO, FIRST, IS_HET,
+                                 IS_NOVALUE)
+from dnakit.kit import Kit, CHR23, CHRMT, CHRY
+from dnakit.stages import stage
+from dnakit.writer import format_rows
+
+# the columns of the extended output file
+FIELDNAMES = ['RSID', 'CHROMOSOME', 'POSITION', 'RESULT']
+
+# True if the father's value is homozygous
+FATHER_HOMO = np.zeros(256, dtype=bool)
+for g, i in GENO_CODE.items():
+    FATHER_HOMO[i] = 2*g[0] == g
+
+# the code of the pair made of two single alleles, mother's first
+JOIN = np.full((256, 256), BADGENO, dtype=np.uint8)
+for a in GENOTYPES[1:]:
+    for b in GENOTYPES[1:]:
+        if len(a) == 1 and len(b) == 1:
+            JOIN[GENO_CODE[a], GENO_CODE[b]] = GENO_CODE[a + b]
+
+# The genotype code of each value that can be deduced for the child, at each
+# of the mother's positions, or BADGENO where nothing can be deduced.
+# These are the rules:
+#   - the child already has a value (not a no-call): nothing to do
+#   - chr23 and MT need the mother's value, Y needs a male child and the
+#     father's value, other chromosomes need the father's value
+#   - mother is heterozygous: can't figure out the child
+#   - male child got mother's chr23, father's Y; any child got mother's MT
+#   - otherwise, if the father is homozygous too, the child has one allele
+#     from each
+# The kits must be sorted and unique (see Kit.unique).
+def deduce(childkit, motherkit, fatherkit, gender):
+    ci = motherkit.align(childkit)
+    fi = motherkit.align(fatherkit)
+    cg = childkit.geno_at(ci)
+    fg = fatherkit.geno_at(fi)
+    mg = motherkit.geno
+    male = gender != 'F'
+
+    chr23 = motherkit.chrom == CHR23
+    chrY = motherkit.chrom == CHRY
+    chrMT = motherkit.chrom == CHRMT
+    fgood = (fg != BADGENO) & ~IS_NOVALUE[fg]
+
+    # continue only if there's sufficient data for us to use at this position
+    usable = np.where(chr23 | chrMT, ~IS_NOVALUE[mg],
+                      np.where(chrY, fgood & male, fgood))
+    usable &= (cg == BADGENO) | IS_NOVALUE[cg]
+    usable &= ~IS_HET[mg]
+
+    new = np.where(FATHER_HOMO[fg], JOIN[FIRST[mg], FIRST[fg]], BADGENO)
+    new[chr23 & male] = FIRST[mg[chr23 & male]]
+    new[chrY] = FIRST[fg[chrY]]
+    new[chrMT] = FIRST[mg[chrMT]]
+    return np.where(usable, new, BADGENO).astype(np.uint8)
+
+# Return the child's kit extended with the values deduced from the parents,
+# sorted by chromosome, position. Where the child had a no-call, the deduced
+# value replaces it.
+def extend_kit(childkit, motherkit, fatherkit, gender):
+    new = deduce(childkit, motherkit, fatherkit, gender)
+    idx = np.flatnonzero(new != BADGENO)
+    ci = motherkit.align(childkit)[idx]
+    replaced = ci >= 0
+    geno = childkit.geno.copy()
+    geno[ci[replaced]] = new[idx[replaced]]
+    kit = Kit(childkit.chrom, childkit.pos, geno, childkit.rsid,
+                  childkit.rsids, childkit.name)
+    added = motherkit.take(idx[~replaced])
+    added.geno = new[idx[~replaced]]
+    return Kit.concatenate([kit, added], childkit.name).sorted()
+
+# The child's kit extended with the values deduced from the parents, as it's
+# written to the output file: without no-calls, and with the rsid names of
+# the father, then the mother, then the child, as rsid names may vary. The
+# kits must be sorted and unique.
+# Returns the kit, and the number of positions in the extended kit, counting
+# the no-calls.
+def extended_output(childkit, motherkit, fatherkit, gender):
+    # Go through all values in the mother's kit to see if we can use them,
+    # and add the new values to the child's kit, sorted by chromosome,
+    # position
+    with stage('extend') as s:
+        kit = extend_kit(childkit, motherkit, fatherkit, gender)
+        s.rows += len(motherkit)
+    n = len(kit)
+    kit = kit.take(~IS_NOVALUE[kit.geno]).renamed([motherkit, fatherkit])
+    return kit, n
+
+# Extend one chromosome of a trio's child kit. Returns the output rows as csv
+# text, and the number of positions in the extended kit.
+def extend_part(childkit, motherkit, fatherkit, gender):
+    kit, n = extended_output(childkit, motherkit, fatherkit, gender)
+    text = format_rows([kit.rsid_names(), kit.chromosomes(), kit.pos,
+                        kit.genotypes()])
+    return text, n
@@ -0,0 +1,117 @@
+# License: GPLv3. See accompanying LICENSE file.
+# No warranty. You are responsible for your use of this program.
+
+# Purpose:
+# Recognize which company a raw data file came from, and split its lines into
+# columns the fast way for that company's format: one str.split per line on a
+# known delimiter, instead of sniffing a csv dialect and making a dictionary
+# for every row.
+#
+# To support another company, add an entry to FORMATS. A file that doesn't
+# match any entry is still read with the csv module, as long as it has the
+# usual rsid,chr,pos,result or rsid,chr,pos,allele1,allele2 columns.
+
+import csv
+from itertools import repeat
+
+
+class Format(object):
+
+    # name: company name, for messages
+    # signatures: text found near the top of the file, e.g. in its comments
+    # delimiter: the character between columns
+    # quoted: True if values are in double quotes
+    def __init__(self, name, signatures, delimiter, quoted=False):
+        self.name = name
+        self.signatures = signatures
+        self.delimiter = delimiter
+        self.quoted = quoted
+
+    # True if the top of a file looks like this format
+    def matches(self, head):
+        return any(s in head for s in self.signatures)
+
+    # Split lines of the file into rows of columns, leaving out comment lines
+    def rows(self, lines):
+        d = self.delimiter
+        if self.quoted:
+            return [l.rstrip('\r\n').replace('"', '').split(d) for l in lines
+                        if l[:1] != '#']
+        return [l.rstrip('\r\n').split(d) for l in lines if l[:1] != '#']
+
+    # Split a block of whole lines into ncols columns. The usual case, where
+    # every line has ncols values, is one split of the whole block; otherwise
+    # the lines are split one at a time, leaving out short lines and the
+    # extra values of long ones, as the csv module did. Every line is
+    # checked, as a short line and a long one would otherwise shift the
+    # columns of the lines after them.
+    def columns(self, text, ncols):
+        d = self.delimiter
+        if self.quoted:
+            text = text.replace('"', '')
+        lines = text.split('\n')
+        if not lines[-1]:
+            lines.pop()
+        if lines and set(map(str.count, lines, repeat(d))) == {ncols - 1}:
+            values = d.join(lines).split(d)
+        else:
+            values = [v for r in self.rows(lines) if len(r) >= ncols
+                          for v in r[:ncols]]
+        return [values[i::ncols] for i in range(ncols)]
+
+# For files that don't match a known format: the csv dialect is guessed from
+# the first lines, as the kit tools have always done.
+class SniffedFormat(Format):
+
+    def __init__(self, dialect):
+        Format.__init__(self, 'unrecognized', (), dialect.delimiter)
+        self.dialect = dialect
+
+    def rows(self, lines):
+        return [r for r in csv.reader([l for l in lines if l[:1] != '#'],
+                                          dialect=self.dialect) if r]
+
+    def columns(self, text, ncols):
+        values = [v for r in self.rows(text.splitlines()) if len(r) >= ncols
+                      for v in r[:ncols]]
+        return [values[i::ncols] for i in range(ncols)]
+
+
+# Known formats, checked in this order. Company names are checked before the
+# FTDNA column header, because some other companies use the same header.
+FORMATS = [
+    Format('AncestryDNA', ('AncestryDNA',), '\t'),
+    Format('23andMe', ('23andMe',), '\t'),
+    Format('MyHeritage', ('MyHeritage',), ',', quoted=True),
+    Format('LivingDNA', ('Living DNA', 'LivingDNA'), '\t'),
+    # also the format written by combine-kits.py and extend-kit.py
+    Format('FTDNA', ('RSID,CHROMOSOME,POSITION,RESULT',), ',', quoted=True),
+    ]
+
+# Return the Format for a file, given the lines at the top of the file, or
+# None if it isn't recognized and doesn't appear to contain csv data.
+def identify(head):
+    text = ''.join(head)
+    for fmt in FORMATS:
+        if fmt.matches(text):
+            return fmt
+    data = [l for l in head if not l.startswith('#')][0:10]
+    try:
+        return SniffedFormat(csv.Sniffer().sniff(''.join(data)))
+    except csv.Error:
+        return None
+
+# Split a block of whole lines into columns (rsids, chromosomes, positions,
+# results), leaving out embedded FTDNA header lines. The chromosome names are
+# as they appear in the file.
+def split_columns(fmt, text, ncols):
+    cols = fmt.columns(text, ncols)
+    if ncols == 4:
+        rs, ch, po, results = cols
+        if 'RESULT' in results:
+            keep = [i for i, r in enumerate(results) if r != 'RESULT']
+            rs, ch, po, results = [[c[i] for i in keep] for c in cols]
+    else:
+        rs, ch, po, a1, a2 = cols
+        results = [a + b for a, b in zip(a1, a2)]
+    return rs, ch, po, results
@@ -0,0 +1,180 @@
+# License: GPLv3. See accompanying LICENSE file.
+# No warranty. You are responsible for your use of this program.
+
+# Purpose:
+# A genetic map, for giving positions in centimorgans (cM) instead of base
+# pairs: the length in cM of a segment is how the matching services measure
+# shared DNA, and it differs from the length in base pairs, as recombination
+# happens more often in some places than others. The map has the cM of many
+# known positions of each chromosome; a position between them is given a cM
+# by linear interpolation, for all positions of a chromosome at once.
+#
+# Map files are read from local files; these formats are recognized, plain or
+# compressed with gzip:
+#   - with a header line, columns chromosome, position, rate, cM, as in the
+#     HapMap (genetic_map_chr1_b37.txt) and Eagle/SHAPEIT
+#     (genetic_map_hg19_withX.txt.gz) maps
+#   - with a header line, columns position, rate, cM, one file for each
+#     chromosome with the chromosome in its name (genetic_map_chr1_...)
+#   - PLINK .map files: chromosome, id, cM, position, with no header
+# The map may be one file, or a folder of files (e.g. one per chromosome). It
+# must be of the same build as the kits, usually build 37.
+#
+# Reading a map of a few million lines takes a few seconds, so the map is
+# kept in the cache folder as arrays, as kits are (see cache.py), and read
+# again only if the map files change.
+
+import gzip
+import os
+import re
+
+import numpy as np
+
+from dnakit.cache import (files_info, named_cache_path, read_cached_arrays,
+                              write_cached_arrays)
+from dnakit.kit import BADCHROM, chrom_codes
+from dnakit.reader import read_block
+from dnakit.stages import stage
+
+# bump this when the arrays kept in the cache change
+MAP_VERSION = 1
+
+# the chromosome in the name of a map file with no chromosome column
+NAME_CHROM = re.compile(r'chr([0-9]+|X|Y|MT)(?![0-9])', re.IGNORECASE)
+
+
+class GeneticMap(object):
+
+    # keys: the positions of the map (see Kit.keys), sorted
+    # cm: the cM of each position
+    def __init__(self, keys, cm):
+        self.keys = keys
+        self.cm = cm
+
+    def __len__(self):
+        return len(self.keys)
+
+    # the positions and cM of one chromosome (by code), as two arrays
+    def chromosome(self, chrom):
+        lo, hi = np.searchsorted(self.keys, np.array(
+            [chrom, chrom + 1], dtype=np.uint64) << np.uint64(32))
+        pos = (self.keys[lo:hi] & np.uint64(0xffffffff)).astype(np.int64)
+        return pos, self.cm[lo:hi]
+
+    # The cM at each position given by chrom (codes) and pos arrays. A
+    # position before the first or after the last one of its chromosome in
+    # the map gets the cM of that one; a chromosome not in the map gives NaN.
+    def cm_at(self, chrom, pos):
+        chrom = np.asarray(chrom)
+        pos = np.asarray(pos)
+        out = np.full(len(pos), np.nan)
+        order = np.argsort(chrom, kind='stable')
+        bounds = np.searchsorted(chrom[order], np.arange(BADCHROM + 1))
+        for c in np.flatnonzero(bounds[1:] > bounds[:-1]):
+            mpos, mcm = self.chromosome(int(c))
+            if len(mpos):
+                on = order[bounds[c]:bounds[c + 1]]
+                out[on] = np.interp(pos[on], mpos, mcm)
+        return out
+
+    # the length in cM of a chromosome (by code), as far as the map goes, or
+    # 0 if it's not in the map
+    def length(self, chrom):
+        mpos, mcm = self.chromosome(chrom)
+        return float(mcm[-1]) if len(mcm) else 0.0
+
+# the map files of a map given as a file or a folder
+def map_files(f):
+    if os.path.isdir(f):
+        return [os.path.join(f, n) for n in sorted(os.listdir(f))
+                    if not n.startswith('.') and
+                    os.path.isfile(os.path.join(f, n))]
+    return [f]
+
+# The chromosome codes, positions and cM of rows of a map file's values (an
+# array with a row for each line). header tells if the file has a header
+# line; code is the chromosome of a file with no chromosome column.
+def map_columns(rows, header, code):
+    if not header:
+        # PLINK: chromosome, id, cM, position
+        chrom = chrom_codes(rows[:, 0])
+        cm, pos = rows[:, 2], rows[:, 3]
+    elif rows.shape[1] == 3:
+        # position, rate, cM; the chromosome is in the file name
+        chrom = np.full(len(rows), code, dtype=np.uint8)
+        pos, cm = rows[:, 0], rows[:, 2]
+    else:
+        # chromosome, position, rate, cM
+        chrom = chrom_codes(rows[:, 0])
+        pos, cm = rows[:, 1], rows[:, 3]
+    return chrom, pos.astype(np.int64), cm.astype(np.float64)
+
+# Read one map file, returning (chromosome codes, positions, cM) arrays. The
+# file is read a block at a time, as kits are, so only one block's values are
+# ever held as strings.
+def read_map_file(f):
+    opener = gzip.open if f.lower().endswith('.gz') else open
+    parts = [(np.zeros(0, np.uint8), np.zeros(0, np.int64),
+              np.zeros(0, np.float64))]
+    with opener(f, 'rt') as mf:
+        first = mf.readline()
+        values = first.split()
+        if not values:
+            return parts[0]
+        try:
+            float(values[-1])
+            header = False
+        except (ValueError, IndexError):
+            header = True
+        ncols = len(values)
+        m = NAME_CHROM.search(os.path.basename(f))
+        code = chrom_codes([m.group(1)])[0] if m else BADCHROM
+        text = ('' if header else first) + read_block(mf)
+        while text:
+            tokens = np.array(text.split(), dtype=object)
+            rows = tokens[:len(tokens) // ncols * ncols].reshape(-1, ncols)
+            parts.append(map_columns(rows, header, code))
+            text = read_block(mf)
+    return tuple(np.concatenate([p[i] for p in parts]) for i in range(3))
+
+# Read a map from its files, as a GeneticMap. Positions on chromosomes that
+# aren't known are left out.
+def read_map(f):
+    with stage('read-map') as s:
+        parts = [read_map_file(mf) for mf in map_files(f)]
+        chrom = np.concatenate([p[0] for p in parts])
+        pos = np.concatenate([p[1] for p in parts])
+        cm = np.concatenate([p[2] for p in parts])
+        good = chrom != BADCHROM
+        keys = (chrom[good].astype(np.uint64) << np.uint64(32)) | \
+            pos[good].astype(np.uint64)
+        order = np.argsort(keys, kind='stable')
+        s.rows += len(keys)
+    return GeneticMap(keys[order], cm[good][order])
+
+# Return the GeneticMap of a map file or folder, or None if it can't be
+# read. If cachedir is given, the map kept there is used if the files haven't
+# changed; otherwise the map is read and kept there for the next run.
+def load_map(f, cachedir=None):
+    try:
+        info = {'version': MAP_VERSION, 'files': files_info(map_files(f))}
+    except (IOError, OSError) as e:
+        print('Could not read the genetic map {}: {}'.format(f, e))
+        return None
+    if cachedir:
+        path = named_cache_path('map', f, cachedir)
+        arrays = read_cached_arrays(path, info, ('keys', 'cm'))
+        if arrays is not None:
+            return GeneticMap(**arrays)
+    try:
+        gmap = read_map(f)
+    except (IOError, OSError, ValueError, EOFError) as e:
+        print('Could not read the genetic map {}: {}'.format(f, e))
+        return None
+    if not len(gmap):
+        print('No positions found in the genetic map {}'.format(f))
+        return None
+    if cachedir:
+        write_cached_arrays(path, cachedir, {'keys': gmap.keys, 'cm': gmap.cm},
+                            info, 'the genetic map')
+    return gmap
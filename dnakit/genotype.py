@@ -0,0 +1,65 @@
+# License: GPLv3. See accompanying LICENSE file.
+# No warranty. You are responsible for your use of this program.
+
+# Purpose:
+# Small integer codes for genotype results, so a kit can store one byte per
+# SNP instead of a string. Code 0 is the empty result (no data), followed by
+# every single allele and every ordered pair of alleles. Pairs keep the order
+# they had in the data file, e.g. "GT" and "TG" are different codes.
+
+import numpy as np
+
+# allele letters that appear in raw data files, including the no-call markers
+ALLELES = 'ACGTDI-0'
+
+GENOTYPES = [''] + list(ALLELES) + [a + b for a in ALLELES for b in ALLELES]
+GENO_CODE = {g: i for i, g in enumerate(GENOTYPES) if g}
+
+# marks a result that could not be encoded
+BADGENO = 255
+
+# These are used variously to indicate no allele called at the position.
+# In the combined kit, we omit these. See also https://learn.familytreedna.com/autosomal-ancestry/universal-dna-matching/read-family-finder-raw-data-file/
+NOVALUE = ('-', '--', '00', 'DD', 'II', 'I', 'D', 'DI')
+
+# True for the codes of no-call results
+IS_NOVALUE = np.zeros(256, dtype=bool)
+IS_NOVALUE[[GENO_CODE[g] for g in NOVALUE]] = True
+
+# for each genotype code, the code of its first allele
+FIRST = np.full(256, BADGENO, dtype=np.uint8)
+# True for the codes of heterozygous pairs
+IS_HET = np.zeros(256, dtype=bool)
+# True for the codes of a single allele or a pair of the same allele, which
+# includes no-calls such as "--"
+IS_HOMO = np.zeros(256, dtype=bool)
+for g, i in GENO_CODE.items():
+    FIRST[i] = GENO_CODE[g[0]]
+    IS_HET[i] = len(g) == 2 and g[0] != g[1]
+    IS_HOMO[i] = len(g) == 1 or g[0] == g[1]
+
+# for each genotype code, the code of the same genotype read from the other
+# strand, e.g. "TC" for "AG"; D, I and the no-call markers stay as they are
+STRAND_PAIRS = {'A': 'T', 'C': 'G', 'G': 'C', 'T': 'A'}
+COMPLEMENT = np.arange(256, dtype=np.uint8)
+for g, i in GENO_CODE.items():
+    COMPLEMENT[i] = GENO_CODE[''.join(STRAND_PAIRS.get(a, a) for a in g)]
+
+# for decoding an array of codes back into strings
+GENO_STRINGS = np.array(GENOTYPES + [''] * (256 - len(GENOTYPES)), dtype=object)
+
+# return the code for a result string, BADGENO if it's not understood
+# results longer than two letters keep only the first two, as the trio tools
+# have always done
+def encode(result):
+    try:
+        return GENO_CODE[result]
+    except KeyError:
+        pass
+    if len(result) > 2:
+        return GENO_CODE.get(result[:2], BADGENO)
+    return BADGENO
+
+# return the string for each code in an array of codes
+def decode(codes):
+    return GENO_STRINGS[codes]
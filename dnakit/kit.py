@@ -0,0 +1,415 @@
+# License: GPLv3. See accompanying LICENSE file.
+# No warranty. You are responsible for your use of this program.
+
+# Purpose:
+# In-memory representation of a raw DNA kit. Instead of a dictionary keyed by
+# (chromosome, position) strings, a Kit keeps parallel arrays with one entry
+# per SNP:
+#   chrom: uint8 index into chr_order
+#   pos:   uint32 position on the chromosome
+#   geno:  uint8 genotype code, see genotype.py
+#   rsid:  uint32 index into the table of rsid names, usually the one shared
+#          by all kits of a run (see manifest.py)
+# This takes a few bytes per SNP, and positions can be matched up between
+# kits with array operations.
+
+import multiprocessing
+
+import numpy as np
+
+from dnakit.cache import read_cached, write_cached
+from dnakit.genotype import (encode, decode, BADGENO, IS_HET, IS_HOMO,
+                                 IS_NOVALUE)
+from dnakit.manifest import Manifest, read_manifest, write_manifest
+from dnakit.reader import read_chunks, normalize_chr
+from dnakit.stages import stage
+
+# chromosomes in the order they are written to output files
+chr_order = ['1', '2', '3', '4', '5', '6', '7', '8', '9', '10', '11', '12',
+    '13', '14', '15', '16', '17', '18', '19', '20', '21', '22', '23',
+    'MT', 'Y']
+CHROM_CODE = {c: i for i, c in enumerate(chr_order)}
+CHR23 = CHROM_CODE['23']
+CHRMT = CHROM_CODE['MT']
+CHRY = CHROM_CODE['Y']
+
+# marks a chromosome name that is not in chr_order
+BADCHROM = 255
+
+# the largest position that fits in a kit (positions are uint32)
+MAXPOS = 0xffffffff
+
+# chr23, MT and Y, the chromosomes that tell the tester's gender, are the last
+# three in chr_order
+SEXCHROMS = (CHR23, CHRMT, CHRY)
+
+# The code in chr_order of each chromosome name in an array, or BADCHROM if
+# it's not known. Names may be as in kits, or start with 'chr' as in other
+# files, e.g. 'chrX' or 'chrM'.
+def chrom_codes(names):
+    names, inv = np.unique(np.asarray(names, dtype=str), return_inverse=True)
+    codes = []
+    for n in names:
+        if n[:3].lower() == 'chr':
+            n = n[3:]
+        if n.upper() in ('M', 'MT'):
+            n = 'MT'
+        codes.append(CHROM_CODE.get(normalize_chr(n.upper()), BADCHROM))
+    return np.array(codes, dtype=np.uint8)[inv.reshape(-1)]
+
+
+class SexCounts(object):
+
+    # The number of SNPs with each genotype code on chr23, MT and Y (a row of
+    # counts for each, as in SEXCHROMS). They are counted while a kit is read,
+    # a block at a time, so the gender can be guessed without another pass
+    # over the kit.
+    def __init__(self, counts=None):
+        self.counts = (np.zeros((len(SEXCHROMS), 256), dtype=np.int64)
+                           if counts is None else counts)
+
+    # count the SNPs with chromosome codes chrom and genotype codes geno
+    def add(self, chrom, geno):
+        sel = (chrom >= CHR23) & (chrom <= CHRY)
+        if sel.any():
+            idx = (chrom[sel].astype(np.int64) - CHR23) * 256 + geno[sel]
+            self.counts += np.bincount(idx, minlength=self.counts.size
+                                           ).reshape(self.counts.shape)
+
+    # the counts of one chromosome, by code
+    def of(self, chrom):
+        return self.counts[chrom - CHR23]
+
+    # the number of SNPs of a chromosome, and how many are not no-calls
+    def snps(self, chrom):
+        return int(self.of(chrom).sum())
+
+    def called(self, chrom):
+        return int(self.of(chrom)[~IS_NOVALUE].sum())
+
+    # the share of the called chr23 SNPs that are heterozygous
+    def x_het_rate(self):
+        return 1.0 * self.of(CHR23)[IS_HET].sum() / max(self.called(CHR23), 1)
+
+    # the share of the Y SNPs that are called
+    def y_call_rate(self):
+        return 1.0 * self.called(CHRY) / max(self.snps(CHRY), 1)
+
+    # the tester's gender, guessed from chr23 data
+    # if there are many heterozygous calls, the kit is probably female
+    # with no chr23 data at all, female is assumed
+    def gender(self):
+        gender = 'F'
+        x = self.of(CHR23)
+        homocount = x[IS_HOMO].sum()
+        if x.sum() and 1.0 * homocount/x.sum() > .95: # arbitrary magic number
+            gender = 'M'
+        return gender
+
+    # a description of the counts, for messages
+    def summary(self):
+        return ('X heterozygous {:.1%}, Y called {:.1%}, MT SNPs {}'.format(
+            self.x_het_rate(), self.y_call_rate(), self.snps(CHRMT)))
+
+    # the counts of several kits together
+    @staticmethod
+    def total(counts):
+        return SexCounts(sum(c.counts for c in counts))
+
+
+class Kit(object):
+
+    # sexcounts are the SexCounts of the kit, if they were counted as it was
+    # read; otherwise they're counted when first needed
+    def __init__(self, chrom, pos, geno, rsid, rsids, name=None,
+                     sexcounts=None):
+        self.chrom = chrom
+        self.pos = pos
+        self.geno = geno
+        self.rsid = rsid
+        self.rsids = rsids
+        self.name = name
+        self.sexcounts = sexcounts
+
+    def __len__(self):
+        return len(self.pos)
+
+    # the arrays of the kit, by name
+    def arrays(self):
+        return {'chrom': self.chrom, 'pos': self.pos, 'geno': self.geno,
+                'rsid': self.rsid, 'rsids': self.rsids,
+                'sexcounts': self.sex_counts().counts}
+
+    # one sortable 64-bit key per SNP: chromosome in the high bits
+    def keys(self):
+        return (self.chrom.astype(np.uint64) << np.uint64(32)) | self.pos
+
+    # a new kit with only the SNPs selected by an index array or mask
+    def take(self, idx):
+        return Kit(self.chrom[idx], self.pos[idx], self.geno[idx],
+                       self.rsid[idx], self.rsids, self.name)
+
+    # True if the SNPs are in chromosome, position order
+    def is_sorted(self):
+        k = self.keys()
+        return bool(np.all(k[1:] >= k[:-1]))
+
+    # a copy in chromosome, position order; stable, so duplicate positions
+    # stay in file order
+    def sorted(self):
+        if self.is_sorted():
+            return self
+        kit = self.take(np.argsort(self.keys(), kind='stable'))
+        kit.sexcounts = self.sexcounts
+        return kit
+
+    # the SNPs of one chromosome (by code), as a kit sharing this kit's
+    # arrays; the kit must be sorted
+    def chromosome(self, chrom):
+        lo, hi = np.searchsorted(self.chrom, [chrom, chrom + 1])
+        return self.take(slice(lo, hi))
+
+    # a sorted copy with one SNP per position, keeping the last one read
+    def unique(self):
+        kit = self.sorted()
+        k = kit.keys()
+        last = np.ones(len(k), dtype=bool)
+        last[:-1] = k[1:] != k[:-1]
+        if last.all():
+            return kit
+        return kit.take(last)
+
+    # For each SNP of this kit, the index of the same position in other, or -1
+    # where other has no value. other must be sorted and unique.
+    def align(self, other):
+        okeys = other.keys()
+        keys = self.keys()
+        idx = np.searchsorted(okeys, keys)
+        idx[idx == len(okeys)] = 0
+        found = (okeys[idx] == keys) if len(okeys) else np.zeros(len(keys), bool)
+        return np.where(found, idx, -1)
+
+    # genotype strings, as an array
+    def genotypes(self):
+        return decode(self.geno)
+
+    # genotype strings at the given indexes, None where the index is -1
+    def genotypes_at(self, idx):
+        out = np.full(len(idx), None, dtype=object)
+        found = idx >= 0
+        out[found] = self.genotypes()[idx[found]]
+        return out
+
+    # genotype codes at the given indexes, BADGENO where the index is -1
+    def geno_at(self, idx):
+        out = np.full(len(idx), BADGENO, dtype=np.uint8)
+        found = idx >= 0
+        out[found] = self.geno[idx[found]]
+        return out
+
+    # rsid strings, as an array
+    def rsid_names(self):
+        return self.rsids[self.rsid].astype(str).astype(object)
+
+    # A copy with the rsid of each SNP taken from the last of the given kits
+    # that has its position, as rsid names may vary between kits. The kits
+    # must be sorted and unique. Kits that share a table of rsid names (see
+    # Manifest) keep it; otherwise the names are put in a new table.
+    def renamed(self, kits):
+        if all(k.rsids is self.rsids for k in kits):
+            rsid = self.rsid.copy()
+            for k in kits:
+                ki = self.align(k)
+                rsid[ki >= 0] = k.rsid[ki[ki >= 0]]
+            rsids = self.rsids
+        else:
+            names = self.rsids[self.rsid].astype(object)
+            for k in kits:
+                ki = self.align(k)
+                names[ki >= 0] = k.rsids[k.rsid[ki[ki >= 0]]]
+            rsids, rsid = np.unique(names.astype(bytes), return_inverse=True)
+        return Kit(self.chrom, self.pos, self.geno, rsid.astype(np.uint32),
+                       rsids, self.name, self.sexcounts)
+
+    # chromosome strings, as an array
+    def chromosomes(self):
+        return np.array(chr_order, dtype=object)[self.chrom]
+
+    # the SexCounts of the kit
+    def sex_counts(self):
+        if self.sexcounts is None:
+            self.sexcounts = SexCounts()
+            self.sexcounts.add(self.chrom, self.geno)
+        return self.sexcounts
+
+    # the tester's gender, guessed from chr23 data (see SexCounts.gender)
+    def guess_gender(self):
+        return self.sex_counts().gender()
+
+    # a kit with no SNPs
+    @staticmethod
+    def empty(name=None):
+        return Kit(np.zeros(0, np.uint8), np.zeros(0, np.uint32),
+                   np.zeros(0, np.uint8), np.zeros(0, np.uint32),
+                   np.zeros(0, 'S1'), name)
+
+    # The given kits, all referring to one table of rsid names. Kits that
+    # share a table (see Manifest) are returned as they are; otherwise their
+    # names are put in one new table.
+    @staticmethod
+    def shared_names(kits):
+        if not kits or all(k.rsids is kits[0].rsids for k in kits):
+            return list(kits)
+        offsets = np.cumsum([0] + [len(k.rsids) for k in kits])
+        rsids, inv = np.unique(np.concatenate([k.rsids for k in kits]),
+                                   return_inverse=True)
+        return [Kit(k.chrom, k.pos, k.geno,
+                        inv[k.rsid.astype(np.int64) + o].astype(np.uint32),
+                        rsids, k.name, k.sexcounts)
+                    for k, o in zip(kits, offsets)]
+
+    # One kit holding all of the SNPs of the given kits, in the given order,
+    # with one table of rsid names (see shared_names).
+    @staticmethod
+    def concatenate(kits, name=None):
+        kits = Kit.shared_names(kits)
+        return Kit(np.concatenate([k.chrom for k in kits]),
+                   np.concatenate([k.pos for k in kits]),
+                   np.concatenate([k.geno for k in kits]),
+                   np.concatenate([k.rsid for k in kits]).astype(np.uint32),
+                   kits[0].rsids, name,
+                   SexCounts.total([k.sexcounts for k in kits])
+                       if all(k.sexcounts is not None for k in kits) else None)
+
+
+# The positions of a chunk as integers. A value that isn't a whole number
+# gives -1, so that its row is skipped rather than the whole kit.
+def parse_positions(po):
+    try:
+        return np.array(po, dtype=np.int64)
+    except (ValueError, OverflowError):
+        return np.array([int(x) if x.strip().isdigit() and
+                             int(x) <= MAXPOS else -1 for x in po],
+                        dtype=np.int64)
+
+# Build a Kit from column chunks, as generated by reader.read_chunks. Only the
+# compact arrays grow with the kit size.
+def chunks_to_kit(chunks, name=None):
+    chroms, poss, genos, names = [], [], [], []
+    sexcounts = SexCounts()
+    for rs, ch, po, rv in chunks:
+        with stage('encode') as s:
+            # chromosome names are normalized once for each distinct name
+            codes = {x: CHROM_CODE.get(normalize_chr(x), BADCHROM) for x in set(ch)}
+            c = np.array([codes[x] for x in ch], dtype=np.uint8)
+            codes = {x: encode(x) for x in set(rv)}
+            g = np.array([codes[x] for x in rv], dtype=np.uint8)
+            p = parse_positions(po)
+            good = (c != BADCHROM) & (g != BADGENO) & (p >= 0) & \
+                (p <= MAXPOS)
+            if not good.all():
+                for i in np.flatnonzero(~good):
+                    print('Skipping {}'.format((rs[i], ch[i], po[i], rv[i])))
+            chroms.append(c[good])
+            genos.append(g[good])
+            sexcounts.add(chroms[-1], genos[-1])
+            poss.append(p[good].astype(np.uint32))
+            names.append(np.array(rs, dtype=bytes)[good])
+            s.rows += len(rs)
+    if not chroms:
+        return Kit.empty(name)
+
+    # rsid names are stored in a table, and referred to by index
+    rsids = np.concatenate(names)
+    return Kit(np.concatenate(chroms), np.concatenate(poss),
+               np.concatenate(genos), np.arange(len(rsids), dtype=np.uint32),
+               rsids, name, sexcounts)
+
+# Read a raw data file into a Kit with its own table of rsid names, or return
+# None if it can't be read.
+def parse_kit(f):
+    with stage('parse') as s:
+        chunks = read_chunks(f)
+        if chunks is None:
+            return None
+        kit = chunks_to_kit(chunks, f)
+        s.rows += len(kit)
+    return kit
+
+# Read several raw data files, returning a list with a Kit (or None) for each.
+# The kits all refer to the rsid names of one manifest: the one given, or else
+# the one kept in cachedir, or else a new one.
+# If cachedir is given, a kit cached there from an earlier run is used instead
+# of reading the file, and newly-read kits are saved there for the next run,
+# along with the manifest.
+# With more than one worker, each file is read and parsed in its own process;
+# workers=None uses one process per processor.
+# liftover is a dictionary of the data files that are of another build, to
+# the chain file for converting each to build 37 (see liftover.py). A file
+# whose chain file can't be read gives None.
+def load_kits(files, cachedir=None, workers=1, manifest=None, liftover=None):
+    if manifest is None:
+        manifest = read_manifest(cachedir) if cachedir else Manifest()
+    kits = [None] * len(files)
+    if cachedir:
+        with stage('read-cache') as s:
+            for i, f in enumerate(files):
+                arrays = read_cached(f, cachedir, manifest.serials())
+                if arrays is not None:
+                    counts = SexCounts(np.array(arrays.pop('sexcounts')))
+                    kits[i] = Kit(rsids=manifest.names, name=f,
+                                      sexcounts=counts, **arrays)
+                    s.rows += len(kits[i])
+
+    todo = [i for i, kit in enumerate(kits) if kit is None]
+    if workers == 1 or len(todo) < 2:
+        parsed = [parse_kit(files[i]) for i in todo]
+    else:
+        if workers is None:
+            workers = multiprocessing.cpu_count()
+        with stage('parse'), \
+                multiprocessing.Pool(min(workers, len(todo))) as pool:
+            parsed = pool.map(parse_kit, [files[i] for i in todo], chunksize=1)
+
+    # the rsid names of newly-read kits go into the manifest, and their
+    # positions, unless they're converted below
+    if liftover is None:
+        liftover = {}
+    with stage('manifest') as s:
+        for i, kit in zip(todo, parsed):
+            if kit is not None:
+                kits[i] = manifest.adopt(kit, not liftover.get(files[i]))
+                s.rows += len(kit)
+        if cachedir and any(kit is not None for kit in parsed):
+            write_manifest(manifest, cachedir)
+    if cachedir and any(kit is not None for kit in parsed):
+        with stage('write-cache') as s:
+            for i in todo:
+                if kits[i] is not None and len(kits[i]):
+                    write_cached(files[i], cachedir, kits[i].arrays(),
+                                     manifest.serial)
+                    s.rows += len(kits[i])
+
+    # kits of another build are converted, each time they're read (the cache
+    # keeps them as read), and their new positions go into the manifest;
+    # liftover.py is imported here, as it uses this module
+    if any(liftover.get(f) for f in files):
+        from dnakit.liftover import lift_file
+        for i, f in enumerate(files):
+            if kits[i] is not None and liftover.get(f):
+                kits[i] = lift_file(f, kits[i], liftover[f], cachedir)
+                if kits[i] is not None:
+                    manifest.add_snps(kits[i].keys(), kits[i].rsid)
+        if cachedir:
+            write_manifest(manifest, cachedir)
+
+    # every kit shares the manifest's table of names, as it is now
+    for kit in kits:
+        if kit is not None:
+            kit.rsids = manifest.names
+    return kits
+
+# Read a raw data file into a Kit, or return None if it can't be read. See
+# load_kits.
+def load_kit(f, cachedir=None, manifest=None, liftover=None):
+    return load_kits([f], cachedir, 1, manifest, liftover)[0]
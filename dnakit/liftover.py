@@ -0,0 +1,244 @@
+# License: GPLv3. See accompanying LICENSE file.
+# No warranty. You are responsible for your use of this program.
+
+# Purpose:
+# Convert the positions of a kit from one build of the reference genome to
+# another, e.g. a build 38 kit to build 37, so it can be used with the other
+# tools, which need build 37. The conversion follows a UCSC chain file, such
+# as hg38ToHg19.over.chain.gz or hg18ToHg19.over.chain.gz (for build 36)
+# from https://hgdownload.soe.ucsc.edu/downloads.html, which lists the
+# blocks of the old build that line up with blocks of the new build. A
+# position is moved to the same place in the new build's block. The start and
+# end of every block go into one sorted index, so all of the positions of a
+# kit are converted at once with a binary search.
+#
+# Some positions can't be converted: those in no block, which are not in the
+# new build; those in more than one block, which may be in more than one
+# place; and those whose block is on a sequence the tools don't use, such as
+# an unplaced contig. Where a block is on the other strand in the new build,
+# the genotypes are read from the other strand too (e.g. AG becomes TC).
+#
+# Reading a chain file takes a few seconds, so the index is kept in the cache
+# folder, as genetic maps are (see genmap.py).
+
+import gzip
+
+import numpy as np
+
+from dnakit.cache import (files_info, named_cache_path, read_cached_arrays,
+                              write_cached_arrays)
+from dnakit.genotype import COMPLEMENT
+from dnakit.kit import BADCHROM, Kit, chrom_codes
+from dnakit.stages import stage
+from dnakit.writer import write_csv
+
+# bump this when the arrays kept in the cache change
+CHAIN_VERSION = 1
+
+# what happened to each position: converted, or why it couldn't be
+MAPPED = 0
+NOT_IN_BUILD = 1
+AMBIGUOUS = 2
+OTHER_SEQUENCE = 3
+REASONS = {NOT_IN_BUILD: 'not in the new build',
+           AMBIGUOUS: 'in more than one place in the new build',
+           OTHER_SEQUENCE: 'on a sequence not used by the tools'}
+
+# in the index, for the stretches of positions in no block, or more than one
+NOBLOCK = -1
+MANYBLOCKS = -2
+
+# the arrays of a ChainIndex
+FIELDS = ('bounds', 'block', 'tstart', 'qchrom', 'qstart', 'minus', 'qsize')
+
+# the columns of the file listing the positions that couldn't be converted
+UNMAPPED_FIELDS = ['RSID', 'CHROMOSOME', 'POSITION', 'REASON']
+
+
+class ChainIndex(object):
+
+    # The blocks of a chain file, over the old build's positions:
+    # bounds: the positions (see Kit.keys; 0-based, as in chain files) where
+    #   a block starts or ends, sorted
+    # block: for the stretch from each of bounds to the next, the index of
+    #   the one block it's in, or NOBLOCK or MANYBLOCKS
+    # for each block, tstart: its first position in the old build; qchrom,
+    #   qstart: its chromosome (code) and first position in the new build,
+    #   counted on its strand; minus: True if that's the other strand;
+    #   qsize: the length of the chromosome in the new build
+    def __init__(self, bounds, block, tstart, qchrom, qstart, minus, qsize):
+        self.bounds = bounds
+        self.block = block
+        self.tstart = tstart
+        self.qchrom = qchrom
+        self.qstart = qstart
+        self.minus = minus
+        self.qsize = qsize
+
+    # The new places of positions given by chrom (codes) and pos arrays.
+    # Returns arrays of the new chromosome codes, the new positions, True
+    # where the strand changes, and what happened to each (MAPPED, or the
+    # reason it wasn't). The new values are 0 where a position wasn't mapped.
+    def lift(self, chrom, pos):
+        p0 = pos.astype(np.int64) - 1
+        keys = (chrom.astype(np.int64) << 32) | np.maximum(p0, 0)
+        i = np.searchsorted(self.bounds, keys, side='right') - 1
+        b = np.full(len(pos), NOBLOCK, dtype=np.int64)
+        inside = (i >= 0) & (p0 >= 0)
+        b[inside] = self.block[i[inside]]
+        reason = np.full(len(pos), MAPPED, dtype=np.uint8)
+        reason[b == NOBLOCK] = NOT_IN_BUILD
+        reason[b == MANYBLOCKS] = AMBIGUOUS
+        found = b >= 0
+        bf = b[found]
+        qchrom = np.zeros(len(pos), dtype=np.uint8)
+        qchrom[found] = self.qchrom[bf]
+        reason[found & (qchrom == BADCHROM)] = OTHER_SEQUENCE
+        q = self.qstart[bf] + (p0[found] - self.tstart[bf])
+        minus = np.zeros(len(pos), dtype=bool)
+        minus[found] = self.minus[bf]
+        newpos = np.zeros(len(pos), dtype=np.int64)
+        newpos[found] = np.where(self.minus[bf], self.qsize[bf] - q, q + 1)
+        mapped = reason == MAPPED
+        return (np.where(mapped, qchrom, 0).astype(np.uint8),
+                np.where(mapped, newpos, 0), minus & mapped, reason)
+
+    # A kit with the SNPs of kit that can be converted, at their new
+    # positions, in chromosome, position order. Also returns the kit of the
+    # SNPs that can't be, and the reason for each (see REASONS).
+    def lift_kit(self, kit):
+        with stage('liftover') as s:
+            chrom, pos, minus, reason = self.lift(kit.chrom, kit.pos)
+            ok = reason == MAPPED
+            geno = np.where(minus[ok], COMPLEMENT[kit.geno[ok]], kit.geno[ok])
+            lifted = Kit(chrom[ok], pos[ok].astype(np.uint32), geno,
+                             kit.rsid[ok], kit.rsids, kit.name).sorted()
+            s.rows += len(kit)
+        return lifted, kit.take(~ok), reason[~ok]
+
+    # the arrays of the index, by name
+    def arrays(self):
+        return {k: getattr(self, k) for k in FIELDS}
+
+
+# Read the blocks of a chain file. Returns arrays of, for each block, the
+# chain it's in, its start in the old build, its length and its start in the
+# new build; and for each chain, the names of its chromosomes in the old and
+# new builds, the length of the new one, and True if it's on the other
+# strand.
+def read_chain_file(f):
+    opener = gzip.open if f.lower().endswith('.gz') else open
+    chains, tnames, qnames, qsizes, minus = [], [], [], [], []
+    tstarts, sizes, qstarts = [], [], []
+    with opener(f, 'rt') as cf:
+        for line in cf:
+            parts = line.split()
+            if not parts:
+                continue
+            if parts[0] == 'chain':
+                # chain score tName tSize tStrand tStart tEnd qName qSize
+                # qStrand qStart qEnd id
+                tnames.append(parts[2])
+                qnames.append(parts[7])
+                qsizes.append(int(parts[8]))
+                minus.append(parts[9] == '-')
+                tpos, qpos = int(parts[5]), int(parts[10])
+                continue
+            # size [dt dq]: a block, then the gaps to the next one
+            size = int(parts[0])
+            chains.append(len(tnames) - 1)
+            tstarts.append(tpos)
+            sizes.append(size)
+            qstarts.append(qpos)
+            if len(parts) == 3:
+                tpos += size + int(parts[1])
+                qpos += size + int(parts[2])
+    return (np.array(chains, dtype=np.int64), np.array(tstarts, np.int64),
+            np.array(sizes, np.int64), np.array(qstarts, np.int64),
+            tnames, qnames, np.array(qsizes, np.int64), np.array(minus, bool))
+
+# Read a chain file into a ChainIndex.
+def read_chain(f):
+    with stage('read-chain') as s:
+        chains, tstarts, sizes, qstarts, tnames, qnames, qsizes, minus = \
+            read_chain_file(f)
+        tchrom = chrom_codes(tnames)[chains] if len(chains) else \
+            np.zeros(0, np.uint8)
+        # blocks on sequences the tools don't use are never looked up
+        keep = tchrom != BADCHROM
+        chains, tstarts, sizes, qstarts = (chains[keep], tstarts[keep],
+                                           sizes[keep], qstarts[keep])
+        starts = (tchrom[keep].astype(np.int64) << 32) | tstarts
+        ends = starts + sizes
+
+        # how many blocks each stretch between bounds is in, and the sum of
+        # their indexes, which is the index of the block where there's one
+        bounds = np.unique(np.concatenate([starts, ends]))
+        si = np.searchsorted(bounds, starts)
+        ei = np.searchsorted(bounds, ends)
+        ids = np.arange(len(starts), dtype=np.float64)
+        cover = np.cumsum(np.bincount(si, minlength=len(bounds)) -
+                          np.bincount(ei, minlength=len(bounds)))
+        idsum = np.cumsum(np.bincount(si, ids, minlength=len(bounds)) -
+                          np.bincount(ei, ids, minlength=len(bounds)))
+        block = np.where(cover == 1, np.round(idsum).astype(np.int64),
+                         np.where(cover == 0, NOBLOCK, MANYBLOCKS))
+        s.rows += len(starts)
+    return ChainIndex(bounds, block, tstarts, chrom_codes(qnames)[chains]
+                          if len(chains) else np.zeros(0, np.uint8),
+                      qstarts, minus[chains], qsizes[chains])
+
+# Return the ChainIndex of a chain file, or None if it can't be read. If
+# cachedir is given, the index kept there is used if the file hasn't changed;
+# otherwise the file is read and the index kept there for the next run.
+def load_chain(f, cachedir=None):
+    try:
+        info = {'version': CHAIN_VERSION, 'files': files_info([f])}
+    except (IOError, OSError) as e:
+        print('Could not read the chain file {}: {}'.format(f, e))
+        return None
+    if cachedir:
+        path = named_cache_path('chain', f, cachedir)
+        arrays = read_cached_arrays(path, info, FIELDS)
+        if arrays is not None:
+            return ChainIndex(**arrays)
+    try:
+        chain = read_chain(f)
+    except (IOError, OSError, ValueError, IndexError, NameError,
+            EOFError) as e:
+        print('Could not read the chain file {}: {}'.format(f, e))
+        return None
+    if cachedir:
+        write_cached_arrays(path, cachedir, chain.arrays(), info,
+                            'the chain file')
+    return chain
+
+# the file listing the positions of data file f that couldn't be converted
+def unmapped_path(f):
+    return f + '.unmapped.csv'
+
+# Convert a kit read from data file f with a chain file, for load_kits.
+# Returns the converted kit, or None if the chain file can't be read. The
+# positions that can't be converted are counted, and listed in a file named
+# by unmapped_path.
+def lift_file(f, kit, chainfile, cachedir=None):
+    chain = load_chain(chainfile, cachedir)
+    if chain is None:
+        return None
+    lifted, unmapped, reason = chain.lift_kit(kit)
+    print('Converted {} with {}: {} positions, {} could not be'.format(
+        f, chainfile, len(lifted), len(unmapped)))
+    if len(unmapped):
+        for r, text in sorted(REASONS.items()):
+            n = int((reason == r).sum())
+            if n:
+                print('  {}: {}'.format(text, n))
+        names = np.array([REASONS.get(r, '') for r in range(max(REASONS) + 1)],
+                         dtype=object)
+        try:
+            write_csv(unmapped_path(f), UNMAPPED_FIELDS,
+                      [unmapped.rsid_names(), unmapped.chromosomes(),
+                       unmapped.pos, names[reason]])
+        except (IOError, OSError) as e:
+            print('Could not list them in {}: {}'.format(unmapped_path(f), e))
+    return lifted
@@ -0,0 +1,167 @@
+# License: GPLv3. See accompanying LICENSE file.
+# No warranty. You are responsible for your use of this program.
+
+# Purpose:
+# A manifest of the SNPs in all of the kits that have been read: each distinct
+# rsid name is stored once, and each position (chromosome, position) has the
+# index of its rsid. Kits refer to rsids by their index in the manifest, so
+# the kits of a run share one table of names instead of each keeping a name
+# for every SNP, and kits can be joined by rsid as cheaply as by position, as
+# both are integer arrays.
+#
+# The manifest is kept in the cache folder, next to the cached kits, and grows
+# as new kits are read. The index of a name never changes once given, so a
+# kit cached with an earlier state of the manifest stays valid. Each saved
+# state has a serial number, and the manifest keeps the serials of the states
+# it grew from, so a kit cached by another run that grew the manifest in a
+# different way is recognized, and read again.
+
+import json
+import os
+import shutil
+import tempfile
+
+import numpy as np
+
+# bump this when the arrays stored in the manifest change
+MANIFEST_VERSION = 1
+
+# the arrays that make up a manifest
+FIELDS = ('names', 'order', 'keys', 'snp_rsid')
+
+
+class Manifest(object):
+
+    # names: rsid names, in the order they were added
+    # order: the indexes of names, in sorted order of the names
+    # keys: positions (see Kit.keys), sorted
+    # snp_rsid: index in names of the rsid for each of keys
+    # serial: identifies this state of the manifest, for the kits cached
+    #   with it
+    # lineage: serials of the earlier states this one grew from
+    def __init__(self, names=None, order=None, keys=None, snp_rsid=None,
+                     serial=None, lineage=()):
+        self.names = np.zeros(0, 'S1') if names is None else names
+        self.order = np.zeros(0, np.int64) if order is None else order
+        self.keys = np.zeros(0, np.uint64) if keys is None else keys
+        self.snp_rsid = (np.zeros(0, np.uint32) if snp_rsid is None
+                             else snp_rsid)
+        self.serial = serial or os.urandom(8).hex()
+        self.lineage = list(lineage)
+        self.changed = False
+
+    def __len__(self):
+        return len(self.names)
+
+    # the serials of the states whose kits are valid with this one
+    def serials(self):
+        return self.lineage + [self.serial]
+
+    # the arrays of the manifest, by name
+    def arrays(self):
+        return {'names': self.names, 'order': self.order, 'keys': self.keys,
+                'snp_rsid': self.snp_rsid}
+
+    # the index of each of the given names, or -1 where it's not in the
+    # manifest
+    def find(self, names):
+        if not len(self.names):
+            return np.full(len(names), -1, dtype=np.int64)
+        i = np.searchsorted(self.names, names, sorter=self.order)
+        i[i == len(self.names)] = 0
+        idx = self.order[i]
+        return np.where(self.names[idx] == names, idx, -1)
+
+    # the index of each of the given names, adding those not already in the
+    # manifest
+    def intern(self, names):
+        idx = self.find(names)
+        new = idx < 0
+        if new.any():
+            newnames, inv = np.unique(names[new], return_inverse=True)
+            idx[new] = len(self.names) + inv
+            self.names = np.concatenate([self.names, newnames])
+            self.order = np.argsort(self.names, kind='stable')
+            self.changed = True
+        return idx.astype(np.uint32)
+
+    # the rsid index for each of the given positions (see Kit.keys), or -1
+    # where the position is not in the manifest
+    def rsid_at(self, keys):
+        if not len(self.keys):
+            return np.full(len(keys), -1, dtype=np.int64)
+        i = np.searchsorted(self.keys, keys)
+        i[i == len(self.keys)] = 0
+        return np.where(self.keys[i] == keys,
+                        self.snp_rsid[i].astype(np.int64), -1)
+
+    # Record the rsid of positions not already in the manifest. The first rsid
+    # given for a position is kept.
+    def add_snps(self, keys, rsid):
+        new = self.rsid_at(keys) < 0
+        keys, first = np.unique(keys[new], return_index=True)
+        if len(keys):
+            keys = np.concatenate([self.keys, keys])
+            rsid = np.concatenate([self.snp_rsid, rsid[new][first]])
+            order = np.argsort(keys, kind='stable')
+            self.keys = keys[order]
+            self.snp_rsid = rsid[order].astype(np.uint32)
+            self.changed = True
+
+    # Return a kit like the given one, but with rsids referring to the
+    # manifest's names, adding its rsids and positions to the manifest. With
+    # positions False, its positions are left out, e.g. for a kit of another
+    # build whose positions are added once they're converted.
+    def adopt(self, kit, positions=True):
+        rsid = self.intern(kit.rsids)[kit.rsid]
+        if positions:
+            self.add_snps(kit.keys(), rsid)
+        return type(kit)(kit.chrom, kit.pos, kit.geno, rsid, self.names,
+                             kit.name, kit.sexcounts)
+
+
+# the folder in the cache for the manifest
+def manifest_path(cachedir):
+    return os.path.join(cachedir, 'manifest')
+
+# Return the manifest kept in the cache folder, or a new, empty one if there
+# is none or it can't be read.
+def read_manifest(cachedir):
+    path = manifest_path(cachedir)
+    try:
+        with open(os.path.join(path, 'manifest.json')) as jf:
+            info = json.load(jf)
+        if info['version'] != MANIFEST_VERSION:
+            return Manifest()
+        arrays = {k: np.load(os.path.join(path, k + '.npy')) for k in FIELDS}
+        return Manifest(serial=info['serial'], lineage=info['lineage'],
+                            **arrays)
+    except (IOError, OSError, ValueError, KeyError):
+        return Manifest()
+
+# Save the manifest in the cache folder, if it changed, as a new state with a
+# new serial. As for cached kits, it's written under a temporary name first.
+def write_manifest(manifest, cachedir):
+    if not manifest.changed:
+        return
+    manifest.lineage.append(manifest.serial)
+    manifest.serial = os.urandom(8).hex()
+    manifest.changed = False
+    tmp = None
+    try:
+        os.makedirs(cachedir, exist_ok=True)
+        tmp = tempfile.mkdtemp(dir=cachedir)
+        arrays = manifest.arrays()
+        for k in FIELDS:
+            np.save(os.path.join(tmp, k + '.npy'), arrays[k])
+        with open(os.path.join(tmp, 'manifest.json'), 'w') as jf:
+            json.dump({'version': MANIFEST_VERSION, 'serial': manifest.serial,
+                       'lineage': manifest.lineage}, jf)
+        path = manifest_path(cachedir)
+        shutil.rmtree(path, ignore_errors=True)
+        os.rename(tmp, path)
+    except (IOError, OSError) as e:
+        print('Could not save the SNP manifest in cache {}: {}'.format(
+            cachedir, e))
+        if tmp:
+            shutil.rmtree(tmp, ignore_errors=True)
@@ -0,0 +1,135 @@
+# License: GPLv3. See accompanying LICENSE file.
+# No warranty. You are responsible for your use of this program.
+
+# Purpose:
+# Compare two kits one-to-one, as the matching services do, for
+# match-kits.py. At a position where both kits have a call, the two are
+# "opposite homozygotes" when each is homozygous for a different allele, e.g.
+# "AA" and "GG": there, the testers can't share either copy of the
+# chromosome. A half-identical segment is a run of common positions with no
+# opposite homozygote in it. Short runs happen by chance between anyone, so
+# only runs of at least a given number of SNPs and base pairs are kept. The
+# runs of every chromosome are found at once with array operations.
+
+import numpy as np
+
+from dnakit.genotype import FIRST, IS_HOMO, IS_NOVALUE
+from dnakit.kit import chr_order, CHR23
+from dnakit.stages import stage
+from dnakit.writer import write_csv
+
+# the columns of the segment file. The first three are those of FTDNA's
+# segment files, so the file can be given to cluster-segments.py. Segments
+# measured with a genetic map also have CM_FIELD.
+FIELDNAMES = ['Chromosome', 'Start Location', 'End Location', 'SNPs']
+CM_FIELD = 'cM'
+
+# the chromosome names written to the segment file: those of chr_order, but X
+# for chr23, as in the matching services' segment files and cluster-segments.py
+SEGMENT_CHROMS = np.array(chr_order, dtype=object)
+SEGMENT_CHROMS[CHR23] = 'X'
+
+# Default shortest segment reported: SNPs both kits have called in it, and
+# its length from the first to the last of them, in base pairs. Two kits from
+# different companies may have only 100-200 thousand positions in common, so
+# the number of SNPs is kept low, and the length does most of the work.
+MINSNPS = 300
+MINBP = 7000000
+
+
+class Segments(object):
+
+    # Segments found between two kits, in chromosome, position order: chrom
+    # (index in chr_order), start and end (positions of the first and last
+    # SNP of the segment) and snps (number of common SNPs in it), all arrays.
+    # cm is the length of each in cM, if measured (see with_cm).
+    def __init__(self, chrom, start, end, snps, cm=None):
+        self.chrom = chrom
+        self.start = start
+        self.end = end
+        self.snps = snps
+        self.cm = cm
+
+    def __len__(self):
+        return len(self.start)
+
+    # the segments selected by an index array or mask
+    def take(self, idx):
+        return Segments(self.chrom[idx], self.start[idx], self.end[idx],
+                            self.snps[idx],
+                            None if self.cm is None else self.cm[idx])
+
+    # length of each segment in base pairs
+    def lengths(self):
+        return self.end.astype(np.int64) - self.start
+
+    # the segments of at least min_snps SNPs and min_bp base pairs
+    def longer(self, min_snps, min_bp):
+        return self.take((self.snps >= min_snps) & (self.lengths() >= min_bp))
+
+    # the same segments, with their lengths in cM from a genmap.GeneticMap
+    def with_cm(self, gmap):
+        cm = gmap.cm_at(self.chrom, self.end) - gmap.cm_at(self.chrom,
+                                                                self.start)
+        return Segments(self.chrom, self.start, self.end, self.snps, cm)
+
+    # the names of the output columns
+    def fieldnames(self):
+        return FIELDNAMES + ([] if self.cm is None else [CM_FIELD])
+
+    # the values of the output columns (see fieldnames)
+    def output_columns(self):
+        columns = [SEGMENT_CHROMS[self.chrom], self.start,
+                   self.end, self.snps]
+        if self.cm is not None:
+            columns.append(np.round(self.cm, 2))
+        return columns
+
+    # Write the segments as a .csv file. A name ending in .csv.gz or .zip is
+    # written compressed, at the given level.
+    def write(self, f, level=6):
+        write_csv(f, self.fieldnames(), self.output_columns(), level)
+
+
+# The positions both kits have called on the chromosomes that are compared
+# (1-22 and X), and the genotype code of each kit there. Returns (keys as
+# given by Kit.keys, codes of kit1, codes of kit2).
+def common_calls(kit1, kit2):
+    kits = []
+    for kit in (kit1, kit2):
+        kit = kit.unique()
+        kits.append(kit.take((kit.chrom <= CHR23) & ~IS_NOVALUE[kit.geno]))
+    keys, i1, i2 = np.intersect1d(kits[0].keys(), kits[1].keys(),
+                                      assume_unique=True, return_indices=True)
+    return keys, kits[0].geno[i1], kits[1].geno[i2]
+
+# True where two arrays of genotype codes are opposite homozygotes. A single
+# allele, as in a male's X, counts as homozygous.
+def opposite_homozygotes(geno1, geno2):
+    return IS_HOMO[geno1] & IS_HOMO[geno2] & (FIRST[geno1] != FIRST[geno2])
+
+# The runs of SNPs that aren't breaks, not crossing from one chromosome to
+# the next. Returns the indexes of the first and the last SNP of each run.
+def runs(chrom, breaks):
+    good = ~breaks
+    newchrom = chrom[1:] != chrom[:-1]
+    first = good.copy()
+    first[1:] &= breaks[:-1] | newchrom
+    last = good.copy()
+    last[:-1] &= breaks[1:] | newchrom
+    return np.flatnonzero(first), np.flatnonzero(last)
+
+# The half-identical segments of two kits of at least min_snps SNPs and
+# min_bp base pairs, as Segments. Also returns the number of positions
+# compared and the number of opposite homozygotes among them.
+def match_kits(kit1, kit2, min_snps=MINSNPS, min_bp=MINBP):
+    with stage('match') as s:
+        keys, geno1, geno2 = common_calls(kit1, kit2)
+        chrom = (keys >> np.uint64(32)).astype(np.uint8)
+        pos = (keys & np.uint64(0xffffffff)).astype(np.uint32)
+        opposite = opposite_homozygotes(geno1, geno2)
+        first, last = runs(chrom, opposite)
+        segments = Segments(chrom[first], pos[first], pos[last],
+                                last - first + 1)
+        s.rows += len(keys)
+    return segments.longer(min_snps, min_bp), len(keys), int(opposite.sum())
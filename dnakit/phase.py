@@ -0,0 +1,238 @@
+# License: GPLv3. See accompanying LICENSE file.
+# No warranty. You are responsible for your use of this program.
+
+# Purpose:
+# Phase a child's alleles into the half coming from each parent, for
+# phase-kit.py. What happens at a position depends only on the child's,
+# mother's and father's genotypes there, the kind of chromosome and the
+# child's gender. So phase_position works out each distinct combination that
+# occurs in the kits once, and the outcome is looked up for every position
+# with array operations.
+
+import itertools
+
+import numpy as np
+
+from dnakit.genotype import GENOTYPES, BADGENO
+from dnakit.kit import CHR23, CHRMT, CHRY
+from dnakit.stages import stage
+from dnakit.writer import format_rows, write_csv
+
+# the columns of the phased output that depend on the genotypes
+COLUMNS = ['child', 'mother', 'father', 'mother allele', 'father allele',
+           'uninherited mother', 'uninherited father']
+
+# the columns of the phased output file
+FIELDNAMES = ['chr', 'pos', 'rsid'] + COLUMNS
+
+# kinds of chromosome, as far as phasing is concerned
+CHROM_KIND = np.zeros(256, dtype=np.int64)
+CHROM_KIND[CHR23] = 1
+CHROM_KIND[CHRMT] = 2
+CHROM_KIND[CHRY] = 3
+KIND_CHROM = {0: '1', 1: '23', 2: 'MT', 3: 'Y'}
+
+# Phase one position. cv is the child's result; mv and fv are the mother's
+# and father's, or None if they have no result there.
+# Returns (outval, rejected, undecided, mv, fv), where outval is the tuple
+# (mother allele, father allele, uninherited mother, uninherited father), or
+# None if the position isn't phased. mv or fv is '--' if the other parent
+# alone decided the phasing.
+# Note that a position can be both phased and rejected, or phased and
+# undecided.
+def phase_position(chrom, cv, mv, fv, gender):
+    outval = None
+    rejected = False
+    undecided = False
+
+    # if chrom=23 and male, it came from mother
+    if mv and gender == 'M' and chrom == '23':
+        outval = (cv[0], '-', mv.replace(cv[0], '', 1), '-')
+        return outval, rejected, undecided, mv, fv
+    # Y chrom always came from father, who has nothing left to give
+    elif fv and gender == 'M' and chrom == 'Y':
+        outval = ('-', cv[0], '-', '-')
+        return outval, rejected, undecided, mv, fv
+
+    # mtDNA always inherited from mother, who has nothing left to give
+    elif chrom == 'MT':
+        outval = (cv[0], '-', '-', '-')
+
+    # normal case: both mother and father have a value at this position
+    if mv and fv:
+        # homozygous
+        if len(cv) == 1 or cv[0] == cv[1]:
+            homo = True
+            letter = cv[0]
+        # father,mother or mother,father, or undecided
+        else:
+            homo = False
+            mf = False
+            fm = False
+            if (cv[0] in mv) and (cv[1] in fv):
+                mf = True
+            if (cv[1] in mv) and (cv[0] in fv):
+                fm = True
+            if mf and fm:
+                undecided = True
+        if homo:
+            mremainder = mv.replace(letter, '', 1)
+            fremainder = fv.replace(letter, '', 1)
+            if len(mremainder) != 1 or len(fremainder) != 1:
+                rejected = True
+            else:
+                outval = (letter, letter, mremainder, fremainder)
+        elif mf:
+            outval = (cv[0], cv[1],
+                mv.replace(cv[0], '', 1),
+                fv.replace(cv[1], '', 1))
+        elif fm:
+            outval = (cv[1], cv[0],
+                mv.replace(cv[1], '', 1),
+                fv.replace(cv[0], '', 1))
+        else:
+            rejected = True
+
+    # didn't find result at this address in either mother or father
+    else:
+        # We're looking for mother or father values that only work one way for
+        # the child alleles. Cartesian product gives all ways child alleles
+        # could be from a parent alleles. Reduce the product to unique values,
+        # then only matching values fit the bill, and if the set contains more
+        # than one matching value, the result is indeterminate because the
+        # allele contributed could be either one.
+
+        if mv:
+            s = set(itertools.product(cv, mv))
+            choices = list(filter(lambda x:x[0]==x[1], s))
+            if len(choices) == 1:
+                mother_allele = choices[0][0]
+                father_allele = cv.replace(mother_allele, '', 1)
+                mother_un = mv.replace(mother_allele, '', 1)
+                father_un = '-'
+                outval = (mother_allele, father_allele,
+                              mother_un, father_un)
+                fv = '--'
+            else:
+                rejected = True # can't determine from mother
+        elif fv:
+            s = set(itertools.product(cv, fv))
+            choices = list(filter(lambda x:x[0]==x[1], s))
+            if len(choices) == 1:
+                father_allele = choices[0][0]
+                mother_allele = cv.replace(father_allele, '', 1)
+                father_un = fv.replace(father_allele, '', 1)
+                mother_un = '-'
+                outval = (mother_allele, father_allele,
+                              mother_un, father_un)
+                mv = '--'
+            else:
+                rejected = True # can't determine from father
+        else:
+            rejected = True # well we tried
+
+    return outval, rejected, undecided, mv, fv
+
+# The output columns (see COLUMNS) for a phased position, given the results of
+# phase_position.
+def output_columns(chrom, cv, mv, fv, outval, gender):
+    mothera = fathera = motherv = fatherv = '-'
+    try:
+        mothera = outval[0]
+    except:
+        pass
+    try:
+        fathera = outval[1]
+    except:
+        pass
+    if mv is not None:
+        motherv = mv
+    if fv is not None:
+        fatherv = fv
+    if (chrom == '23' and gender == 'M') or chrom == 'MT':
+        fathera = '-' # allele didn't come from father, even if data
+    if chrom == 'Y':
+        fatherv = fathera = cv # father's must be child's
+    elif chrom == 'MT':
+        motherv = mothera = cv # mother's must be child's
+    return (cv, motherv, fatherv, mothera, fathera, outval[2], outval[3])
+
+# Phase every position of the child. The parents' kits must be sorted and
+# unique (see Kit.unique).
+# Returns (phased, rejected, undecided, columns): three boolean arrays with an
+# entry for each of the child's positions, and an object array with a row of
+# output columns (see COLUMNS) for each position, filled in where phased.
+def phase_kits(childkit, motherkit, fatherkit, gender):
+    mi = childkit.align(motherkit)
+    fi = childkit.align(fatherkit)
+    mg = motherkit.geno_at(mi)
+    fg = fatherkit.geno_at(fi)
+
+    # each distinct combination is phased once
+    combo = CHROM_KIND[childkit.chrom] << 24
+    combo |= childkit.geno.astype(np.int64) << 16
+    combo |= mg.astype(np.int64) << 8
+    combo |= fg
+    combos, inv = np.unique(combo, return_inverse=True)
+
+    n = len(combos)
+    phased = np.zeros(n, dtype=bool)
+    rejected = np.zeros(n, dtype=bool)
+    undecided = np.zeros(n, dtype=bool)
+    columns = np.empty((n, len(COLUMNS)), dtype=object)
+    for i, x in enumerate(combos.tolist()):
+        chrom = KIND_CHROM[x >> 24]
+        cv = GENOTYPES[(x >> 16) & 255]
+        mv = GENOTYPES[(x >> 8) & 255] if (x >> 8) & 255 != BADGENO else None
+        fv = GENOTYPES[x & 255] if x & 255 != BADGENO else None
+        outval, rejected[i], undecided[i], mv, fv = phase_position(
+            chrom, cv, mv, fv, gender)
+        if outval is not None:
+            phased[i] = True
+            columns[i] = output_columns(chrom, cv, mv, fv, outval, gender)
+    return phased[inv], rejected[inv], undecided[inv], columns[inv]
+
+
+class Phased(object):
+
+    # The phased positions of a child's kit: kit has the child's SNPs that
+    # were phased, with the rsid names of the father, then the mother, then
+    # the child, as rsid names may vary; columns has the values of COLUMNS for
+    # each. counts are (phased, rejected, undecided, positions in any of the
+    # three kits, child positions).
+    def __init__(self, kit, columns, counts):
+        self.kit = kit
+        self.columns = columns
+        self.counts = counts
+
+    # the values of each of FIELDNAMES, for writing
+    def output_columns(self):
+        return ([self.kit.chromosomes(), self.kit.pos, self.kit.rsid_names()] +
+                [self.columns[:, i] for i in range(len(COLUMNS))])
+
+    # write the phased output file
+    def write(self, f, level=6):
+        write_csv(f, FIELDNAMES, self.output_columns(), level)
+
+# Phase a child's kit with the parents' kits, returning a Phased. The kits
+# must be sorted and unique.
+def phase_trio(childkit, motherkit, fatherkit, gender):
+    kits = [childkit, motherkit, fatherkit]
+
+    # phase every position of the child
+    with stage('phase') as s:
+        phased, rejected, undecided, columns = phase_kits(
+            childkit, motherkit, fatherkit, gender)
+        s.rows += len(childkit)
+    outkeys = np.flatnonzero(phased)
+    kit = childkit.take(outkeys).renamed([motherkit, fatherkit])
+    npositions = len(np.unique(np.concatenate([k.keys() for k in kits])))
+    return Phased(kit, columns[outkeys],
+                  (len(outkeys), int(rejected.sum()), int(undecided.sum()),
+                   npositions, len(childkit)))
+
+# Phase one chromosome of a trio. Returns the output rows as csv text, and
+# the counts (see Phased).
+def phase_part(childkit, motherkit, fatherkit, gender):
+    phased = phase_trio(childkit, motherkit, fatherkit, gender)
+    return format_rows(phased.output_columns()), phased.counts
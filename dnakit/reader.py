@@ -0,0 +1,142 @@
+# License: GPLv3. See accompanying LICENSE file.
+# No warranty. You are responsible for your use of this program.
+
+# Purpose:
+# Read raw data files from AncestryDNA, 23andMe, FTDNA, MyHeritage, LivingDNA
+# and kits produced by combine-kits.py. The file is read a chunk at a time, so
+# the whole file is never held in memory. See formats.py for how the lines of
+# each company's format are split into columns.
+
+# File types currently handled:
+#   .csv, .txt: plain csv file
+#   .csv.gz: compressed csvfile
+#   .zip: zipped csvfile
+# if there is a problem with a .zip, try unzipping it before running
+
+import errno
+import gzip
+import io
+import zipfile
+
+from dnakit.formats import identify, split_columns
+from dnakit.stages import stage
+
+# number of characters of text read from a file at a time
+CHUNKSIZE = 1 << 20
+
+# make sure chromosome name is presented consistently
+# sometimes X results present as 'X', 'XY', '23', or '25' - always use '23'
+# sometimes MT results present as '26'
+# sometimes Y results present as '24'
+xmap = {'X': '23', '25': '23', 'XY': '23',
+        '26': 'MT',
+        '24': 'Y'}
+def normalize_chr(chrom):
+    try:
+        c = xmap[chrom]
+    except KeyError:
+        c = chrom
+    return c
+
+# open a data file and return a text stream, or None if it can't be read
+def open_textfile(f):
+    try:
+        if f.lower().endswith('.csv.gz'):
+            return gzip.open(f, 'rt')
+        elif f.lower().endswith('.zip'):
+            with zipfile.ZipFile(f) as zf:
+                for info in zf.filelist:
+                    csvf = info.filename
+                    if csvf.lower().endswith('.txt') or csvf.lower().endswith('.csv'):
+                        break
+                # the member stays readable after the archive is closed
+                return io.TextIOWrapper(zf.open(csvf), encoding='utf8')
+        elif f.lower().endswith('.csv') or f.lower().endswith('.txt'):
+            return open(f, 'r')
+        else:
+            print('Skipping unrecognized file type: {} - use .csv, .txt, or .zip'.format(f))
+            return None
+    except IOError as ioe:
+        if ioe.errno == errno.ENOENT:
+            print('Could not find {} - check file name and readability.'.format(f))
+        else:
+            print('There may be a problem with {} - did not read it.'.format(f))
+        return None
+    except TypeError:
+        print('There was a problem processing {} - try unzipping it.'.format(f))
+        return None
+    except Exception as e:
+        print('Error "{}" happened while processing {} - continuing.'.format(e,f))
+        return None
+
+# generate the lines of a text stream, leaving out comment lines
+def datalines(stream):
+    for l in stream:
+        if not l.startswith('#'):
+            yield l
+
+# read about CHUNKSIZE characters of text, ending at the end of a line
+def read_block(stream):
+    with stage('decompress'):
+        text = stream.read(CHUNKSIZE)
+        if text and not text.endswith('\n'):
+            text += stream.readline()
+    return text
+
+# Generate column chunks (rsids, chromosomes, positions, results) from a kit
+# in the given Format. text is the first block of the file; the rest is read
+# from the stream as needed. Chromosome names are as they appear in the file.
+def kit_chunks(f, stream, fmt, text):
+    with stream:
+        try:
+            # skip the comments at the top; the first data line tells the
+            # number of columns, and it's left out if it's a header line
+            start = 0
+            while start < len(text) and (text[start] == '#' or
+                                         text[start] == '\n'):
+                start = text.find('\n', start) + 1 or len(text)
+            end = text.find('\n', start) + 1 or len(text)
+            rows = fmt.rows([text[start:end]])
+            if not rows:
+                return
+            first = rows[0]
+            ncols = len(first)
+            if ncols not in (4,5):
+                raise ValueError('unhandled type of csv file {} with fields{}'.
+                                     format(f,first))
+            if first[0].lower().strip() == 'rsid':
+                start = end
+            text = text[start:]
+            while text:
+                with stage('split') as s:
+                    cols = split_columns(fmt, text, ncols)
+                    s.rows += len(cols[0])
+                yield cols
+                text = read_block(stream)
+        except (IOError, EOFError, zipfile.BadZipFile) as e:
+            print('Error "{}" happened while reading {} - stopped reading.'.
+                      format(e,f))
+
+# Open a kit and return a generator of column chunks, or None if the file
+# can't be used. Each chunk is a tuple of sequences: (rsids, chromosomes,
+# positions, results), holding the unmodified strings from about CHUNKSIZE
+# characters of the file. The result is the allele pair as given in the file.
+def read_chunks(f):
+    stream = open_textfile(f)
+    if stream is None:
+        return None
+
+    # identify the file format from the top of the file
+    try:
+        text = read_block(stream)
+    except Exception as e:
+        print('Error "{}" happened while processing {} - continuing.'.format(e,f))
+        stream.close()
+        return None
+    with stage('sniff'):
+        fmt = identify(text[0:65536].splitlines(True)[0:100])
+    if fmt is None:
+        print('{} does not appear to contain csv data - skipping'.format(f))
+        stream.close()
+        return None
+    return kit_chunks(f, stream, fmt, text)
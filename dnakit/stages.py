@@ -0,0 +1,147 @@
+# License: GPLv3. See accompanying LICENSE file.
+# No warranty. You are responsible for your use of this program.
+
+# Purpose:
+# Record how long each stage of a kit tool's work takes, to find out where
+# the time goes in a long run. The code of the tools marks its stages:
+#   with stage('parse') as s:
+#       ...
+#       s.rows += n
+# Nothing is recorded unless start_recording is called first, so the marks
+# cost next to nothing in a normal run. When recording, each stage gets its
+# wall-clock time, processor time, the number of rows it handled, and
+# optionally the peak memory allocated while it ran (with tracemalloc, which
+# slows the run down) and a cProfile of it. A stage that runs many times, e.g.
+# once per block of a file, adds up over the runs.
+#
+# Only stages run in this process are recorded; the work of worker processes
+# shows up as the time the stage that started them took. Use one worker to
+# see all of the stages.
+
+import contextlib
+import cProfile
+import json
+import os
+import time
+import tracemalloc
+
+
+class Record(object):
+
+    # The totals for one named stage: number of times it ran, wall-clock and
+    # processor time in seconds, rows handled, the most memory allocated at
+    # once while it ran, in bytes, and its cProfile, if any.
+    def __init__(self, name):
+        self.name = name
+        self.calls = 0
+        self.wall = 0.0
+        self.cpu = 0.0
+        self.rows = 0
+        self.peak = 0
+        self.profile = None
+
+    def report(self):
+        r = {'name': self.name, 'calls': self.calls, 'wall': self.wall,
+             'cpu': self.cpu, 'rows': self.rows}
+        if tracemalloc.is_tracing():
+            r['peak_bytes'] = self.peak
+        return r
+
+
+# given to stages when not recording; what is added to it is never used
+class NullRecord(object):
+    rows = 0
+
+# the records of the stages, by name, in the order they first ran, or None
+# when not recording
+records = None
+# folder for the cProfile files of the stages, or None
+profiledir = None
+# the stages running now, outermost first
+running = []
+# True while a stage is being profiled
+profiling = False
+# when recording started
+started = None
+
+# Start recording the stages. memory traces the memory allocated in each
+# stage; profile_dir is a folder to write a cProfile file for each stage to.
+def start_recording(memory=True, profile_dir=None):
+    global records, profiledir, running, profiling, started
+    records = {}
+    profiledir = profile_dir
+    running = []
+    profiling = False
+    started = (time.perf_counter(), time.process_time())
+    if memory and not tracemalloc.is_tracing():
+        tracemalloc.start()
+
+# update the memory peak of the running stages, and start a new peak
+def note_peak():
+    peak = tracemalloc.get_traced_memory()[1]
+    for r in running:
+        r.peak = max(r.peak, peak)
+    tracemalloc.reset_peak()
+
+# Mark a stage of the work, as a context manager giving the stage's Record.
+# Only the outermost stage being profiled is profiled; stages inside it are
+# part of its profile.
+@contextlib.contextmanager
+def stage(name):
+    global profiling
+    if records is None:
+        yield NullRecord()
+        return
+    r = records.get(name)
+    if r is None:
+        r = records[name] = Record(name)
+    tracing = tracemalloc.is_tracing()
+    if tracing:
+        note_peak()
+    profile = None
+    if profiledir and not profiling:
+        if r.profile is None:
+            r.profile = cProfile.Profile()
+        profile = r.profile
+        profiling = True
+    running.append(r)
+    wall, cpu = time.perf_counter(), time.process_time()
+    if profile:
+        profile.enable()
+    try:
+        yield r
+    finally:
+        if profile:
+            profile.disable()
+            profiling = False
+        r.wall += time.perf_counter() - wall
+        r.cpu += time.process_time() - cpu
+        r.calls += 1
+        if tracing:
+            note_peak()
+        running.pop()
+
+# The recorded stages: a dictionary with the total wall-clock and processor
+# time since recording started, and a list with the totals of each stage.
+def report():
+    if records is None:
+        return None
+    wall, cpu = started
+    return {'wall': time.perf_counter() - wall,
+            'cpu': time.process_time() - cpu,
+            'stages': [r.report() for r in records.values()]}
+
+# Save the report of the stages to a .json file, and write the cProfile of
+# each profiled stage to a file named after it in the profile folder.
+def write_report(f):
+    if records is None:
+        return
+    with open(f, 'w') as rf:
+        json.dump(report(), rf, indent=1)
+    if profiledir:
+        os.makedirs(profiledir, exist_ok=True)
+        for r in records.values():
+            if r.profile:
+                r.profile.dump_stats(os.path.join(profiledir,
+                                                     r.name + '.prof'))
+    print('Wrote the report of the stages to {}'.format(f))
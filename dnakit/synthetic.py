@@ -0,0 +1,201 @@
+# License: GPLv3. See accompanying LICENSE file.
+# No warranty. You are responsible for your use of this program.
+
+# Purpose:
+# Make raw data files for a made-up family trio, in the format of each company
+# the kit tools read, for measuring the tools without anyone's real DNA data.
+# The genotypes are random, but follow inheritance: the child has one allele
+# from each parent on the autosomes, a son has his mother's X and his father's
+# Y, and everyone has their mother's MT. Like real kits, each company's kit
+# has most but not all of the SNPs, and a few no-calls.
+
+import numpy as np
+
+from dnakit.kit import chr_order, CHR23, CHRMT, CHRY
+from dnakit.writer import output_file
+
+# the companies whose formats can be written
+VENDORS = ('AncestryDNA', '23andMe', 'FTDNA', 'MyHeritage', 'LivingDNA')
+
+# approximate length of each chromosome in chr_order, in Mbp (build 37)
+LENGTHS = [249, 243, 198, 191, 181, 171, 159, 146, 141, 136, 135, 134, 115,
+           107, 103, 90, 81, 78, 59, 63, 48, 51, 155, 0.0166, 59]
+
+# share of all SNPs on each chromosome, about as in the kits of the companies:
+# by length, except X has fewer, and Y and MT only a few
+SHARE = np.array(LENGTHS, dtype=float)
+SHARE[CHR23] *= 0.6
+SHARE /= SHARE.sum()
+SHARE[CHRMT] = 0.0003
+SHARE[CHRY] = 0.003
+SHARE /= SHARE.sum()
+
+# nucleotides, indexed by allele code; NOALLELE marks no allele
+BASES = np.array(list('ACGT'))
+NOALLELE = 255
+
+# the share of the SNPs each company's kit has, and its share of no-calls
+COVERAGE = 0.85
+NOCALLS = 0.01
+
+
+class Panel(object):
+
+    # The SNPs of the made-up kits, nsnps of them, sorted by chromosome,
+    # position: chrom (index in chr_order), pos, the two allele codes that
+    # occur (ref, alt), the frequency of alt, and the rsid name.
+    def __init__(self, nsnps, rng):
+        counts = np.maximum(np.round(SHARE * nsnps).astype(np.int64), 1)
+        chroms, poss = [], []
+        for c, n in enumerate(counts):
+            top = max(int(LENGTHS[c] * 1e6), 2 * n)
+            pos = np.unique(rng.integers(1, top, int(n * 1.1) + 16))
+            pos = np.sort(rng.choice(pos, min(n, len(pos)), replace=False))
+            chroms.append(np.full(len(pos), c, dtype=np.uint8))
+            poss.append(pos.astype(np.uint32))
+        self.chrom = np.concatenate(chroms)
+        self.pos = np.concatenate(poss)
+        n = len(self.pos)
+        self.ref = rng.integers(0, 4, n).astype(np.uint8)
+        self.alt = ((self.ref + rng.integers(1, 4, n)) % 4).astype(np.uint8)
+        self.freq = rng.uniform(0.05, 0.95, n)
+        number = rng.permutation(n).astype(np.int64) * 41 + rng.integers(1, 41, n)
+        self.rsids = np.char.add('rs', number.astype(str))
+
+    def __len__(self):
+        return len(self.pos)
+
+
+class Person(object):
+
+    # The genotype of one person at every SNP of a panel: two allele codes
+    # per SNP. Where a person has only one allele (X and Y of a male, MT),
+    # both are the same; a female has NOALLELE on Y.
+    def __init__(self, a1, a2, male):
+        self.a1 = a1
+        self.a2 = a2
+        self.male = male
+
+    # A person whose parents aren't in the panel: alleles are drawn by their
+    # frequency.
+    @staticmethod
+    def founder(panel, male, rng):
+        n = len(panel)
+        a1 = np.where(rng.random(n) < panel.freq, panel.alt, panel.ref)
+        a2 = np.where(rng.random(n) < panel.freq, panel.alt, panel.ref)
+        return Person(a1, a2, male).with_sex(panel)
+
+    # A child of mother and father, who passes on one allele of each pair.
+    @staticmethod
+    def child(panel, mother, father, male, rng):
+        n = len(panel)
+        m = np.where(rng.integers(0, 2, n) == 1, mother.a2, mother.a1)
+        f = np.where(rng.integers(0, 2, n) == 1, father.a2, father.a1)
+        # a son has his mother's X and his father's Y; everyone has their
+        # mother's MT
+        if male:
+            x = panel.chrom == CHR23
+            f[x] = m[x]
+            y = panel.chrom == CHRY
+            m[y] = f[y]
+        mt = panel.chrom == CHRMT
+        m[mt] = mother.a1[mt]
+        f[mt] = mother.a1[mt]
+        return Person(m, f, male).with_sex(panel)
+
+    # make the alleles agree with the person's sex, as described above
+    def with_sex(self, panel):
+        one = panel.chrom == CHRMT
+        if self.male:
+            one |= (panel.chrom == CHR23) | (panel.chrom == CHRY)
+        self.a2 = np.where(one, self.a1, self.a2).astype(np.uint8)
+        self.a1 = self.a1.astype(np.uint8)
+        if not self.male:
+            y = panel.chrom == CHRY
+            self.a1[y] = NOALLELE
+            self.a2[y] = NOALLELE
+        return self
+
+# the company's chromosome names, for each chromosome in chr_order
+def chromosome_names(vendor):
+    names = np.array(chr_order, dtype=object)
+    if vendor == 'AncestryDNA':
+        names[CHR23], names[CHRY], names[CHRMT] = '23', '24', '26'
+    else:
+        names[CHR23] = 'X'
+    return names
+
+# the lines at the top of a company's file, ending with its column header
+HEADERS = {
+    'AncestryDNA': '#AncestryDNA raw data download\n'
+                   '#This file was made up for testing\n'
+                   'rsid\tchromosome\tposition\tallele1\tallele2\n',
+    '23andMe': '# This data file generated by 23andMe\n'
+               '# This file was made up for testing\n'
+               '# rsid\tchromosome\tposition\tgenotype\n',
+    'FTDNA': 'RSID,CHROMOSOME,POSITION,RESULT\n',
+    'MyHeritage': '# MyHeritage DNA raw data.\n'
+                  '# This file was made up for testing\n'
+                  'RSID,CHROMOSOME,POSITION,RESULT\n',
+    'LivingDNA': '# Living DNA customer genotype data download file version: '
+                 '1.0.1\n'
+                 '# This file was made up for testing\n'
+                 '# rsid\tchromosome\tposition\tgenotype\n',
+    }
+
+# Write a person's kit in a company's format, to file f. A name ending in
+# .csv.gz or .zip is written compressed (see writer.output_file). The kit has
+# about COVERAGE of the SNPs, with about NOCALLS of them no-calls. Like the
+# companies' files, FTDNA has no Y or MT, and 23andMe writes one letter where
+# a male has one allele.
+# Returns the number of SNPs written.
+def write_kit(f, panel, person, vendor, rng, level=6):
+    keep = rng.random(len(panel)) < COVERAGE
+    if vendor == 'FTDNA':
+        keep &= (panel.chrom != CHRY) & (panel.chrom != CHRMT)
+    idx = np.flatnonzero(keep)
+    a1 = person.a1[idx]
+    a2 = person.a2[idx]
+    nocall = (rng.random(len(idx)) < NOCALLS) | (a1 == NOALLELE)
+    nocallchar = '0' if vendor == 'AncestryDNA' else '-'
+    first = np.where(nocall, nocallchar, BASES[np.minimum(a1, 3)])
+    second = np.where(nocall, nocallchar, BASES[np.minimum(a2, 3)])
+    rsids = panel.rsids[idx].astype(object)
+    chroms = chromosome_names(vendor)[panel.chrom[idx]]
+    pos = panel.pos[idx].astype(str).astype(object)
+
+    if vendor == 'AncestryDNA':
+        columns = [rsids, chroms, pos, first.astype(object),
+                   second.astype(object)]
+    else:
+        result = np.char.add(first, second).astype(object)
+        if vendor == '23andMe' and person.male:
+            one = np.isin(panel.chrom[idx], (CHR23, CHRY, CHRMT))
+            result[one] = first[one]
+        columns = [rsids, chroms, pos, result]
+    if vendor in ('FTDNA', 'MyHeritage'):
+        columns = [np.char.add(np.char.add('"', c.astype(str)), '"').
+                       astype(object) for c in columns]
+        delimiter = ','
+    else:
+        delimiter = '\t'
+
+    with output_file(f, level) as out:
+        out.write(HEADERS[vendor])
+        for i in range(0, len(idx), 65536):
+            block = slice(i, i + 65536)
+            out.write('\n'.join(delimiter.join(row) for row in
+                                    zip(*[c[block] for c in columns])))
+            out.write('\n')
+    return len(idx)
+
+# Make a panel of nsnps SNPs and a trio of mother, father and child, from a
+# random number seed. Returns (panel, {'mother': ..., 'father': ...,
+# 'child': ...}), the people being Person objects.
+def make_trio(nsnps, seed=1, male=True):
+    rng = np.random.default_rng(seed)
+    panel = Panel(nsnps, rng)
+    mother = Person.founder(panel, False, rng)
+    father = Person.founder(panel, True, rng)
+    child = Person.child(panel, mother, father, male, rng)
+    return panel, {'mother': mother, 'father': father, 'child': child}
@@ -0,0 +1,101 @@
+# License: GPLv3. See accompanying LICENSE file.
+# No warranty. You are responsible for your use of this program.
+
+# Purpose:
+# Run the trio tools (phase-kit.py, extend-kit.py) on several trios at once,
+# e.g. for all of the children in a family. The trios are listed in a
+# manifest, each distinct kit is read only once and shared by every trio it's
+# part of. Each trio is worked on one chromosome at a time, and the
+# chromosomes of all of the trios can run in separate processes at the same
+# time.
+
+import csv
+import multiprocessing
+
+from dnakit.kit import Kit, chr_order, load_kits
+from dnakit.stages import stage
+
+# the kits of the trios being run, by file name
+shared_kits = {}
+
+# Read a manifest: a csv file with one trio per line, giving the file names of
+#   child, mother, father, output
+# A first line starting with "child" is a header, and is skipped. Blank lines
+# and lines starting with # are skipped too.
+def read_manifest(f):
+    trios = []
+    with open(f) as mf:
+        lines = [l for l in mf if l.strip() and not l.startswith('#')]
+    for row in csv.reader(lines):
+        row = [x.strip() for x in row]
+        if row[0].lower() == 'child':
+            continue
+        if len(row) != 4 or not all(row):
+            print('Skipping {} in {} - requires child, mother, father, output'.
+                      format(row, f))
+            continue
+        trios.append(tuple(row))
+    return trios
+
+# Read every distinct kit of the trios once, returning a dictionary of file
+# name to Kit. A file that can't be read gives an empty kit. liftover is as
+# for load_kits.
+def load_trio_kits(trios, cachedir=None, workers=1, liftover=None):
+    files = []
+    for trio in trios:
+        files += [f for f in trio[0:3] if f not in files]
+    kits = {}
+    for f, kit in zip(files, load_kits(files, cachedir, workers, None,
+                                          liftover)):
+        if kit is None:
+            kit = Kit.empty(f)
+        # one value per position; if a position repeats, the last one read is
+        # used
+        kits[f] = kit.unique()
+        print('Done with {}; positions now stored: {}'.format(f,len(kits[f])))
+    return kits
+
+# set the kits in a worker process
+def share_kits(kits):
+    global shared_kits
+    shared_kits = kits
+
+# func(childkit, motherkit, fatherkit, gender) for one chromosome of a trio,
+# given a (func, trio, chromosome code, gender) job
+def run_part(args):
+    func, trio, chrom, gender = args
+    childkit, motherkit, fatherkit = [shared_kits[f].chromosome(chrom)
+                                          for f in trio[0:3]]
+    return func(childkit, motherkit, fatherkit, gender)
+
+# Run func(childkit, motherkit, fatherkit, gender) for each trio, with the
+# kits from load_trio_kits, once for each chromosome in chr_order, giving it
+# only that chromosome's part of the kits. The child's gender is guessed once
+# for each trio, from all of its chr23 data.
+# Trios and chromosomes are independent of each other, so with more than one
+# worker and more than one trio (e.g. from a manifest), the parts run in
+# separate processes, at most one for each trio, as every process is sent all
+# of the kits; workers=None uses one process per processor. One trio's parts
+# are small, and run in this process. func must be defined at the top level of
+# a module.
+# Returns a list with (gender, results) for each trio, where results is the
+# list of what func returned for each chromosome, in chr_order.
+def run_trios(func, trios, kits, workers=1):
+    with stage('gender'):
+        genders = [kits[trio[0]].guess_gender() for trio in trios]
+    nchroms = len(chr_order)
+    jobs = [(func, trio, chrom, gender) for trio, gender in zip(trios, genders)
+                for chrom in range(nchroms)]
+    if workers is None:
+        workers = multiprocessing.cpu_count()
+    workers = min(workers, len(trios))
+    if workers <= 1:
+        share_kits(kits)
+        parts = [run_part(job) for job in jobs]
+    else:
+        with stage(func.__name__), \
+                multiprocessing.Pool(workers, initializer=share_kits,
+                                     initargs=(kits,)) as pool:
+            parts = pool.map(run_part, jobs, chunksize=1)
+    return [(gender, parts[i*nchroms:(i+1)*nchroms])
+                for i, gender in enumerate(genders)]
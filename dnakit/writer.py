@@ -0,0 +1,80 @@
+# License: GPLv3. See accompanying LICENSE file.
+# No warranty. You are responsible for your use of this program.
+
+# Purpose:
+# Write the .csv output files of the kit tools. Rows are formatted from
+# arrays, a large block at a time, by the csv module, instead of one
+# dictionary per row. An output file name ending in .csv.gz or .zip is
+# compressed as it's written, ready for uploading to a matching service.
+
+import contextlib
+import csv
+import gzip
+import io
+import os
+import zipfile
+
+import numpy as np
+
+from dnakit.stages import stage
+
+# number of rows formatted at a time
+BLOCKSIZE = 65536
+
+# Open an output file for writing text, as a context manager. A name ending
+# in .gz is written gzip-compressed; a name ending in .zip is written as a zip
+# archive holding one .csv file of the same name. level is the compression
+# level, from 1 (fastest) to 9 (smallest).
+@contextlib.contextmanager
+def output_file(f, level=6):
+    if f.lower().endswith('.gz'):
+        with gzip.open(f, 'wt', compresslevel=level, encoding='utf8',
+                           newline='') as out:
+            yield out
+    elif f.lower().endswith('.zip'):
+        member = os.path.basename(f)[:-4]
+        if not member.lower().endswith('.csv'):
+            member += '.csv'
+        with zipfile.ZipFile(f, 'w', zipfile.ZIP_DEFLATED,
+                                 compresslevel=level) as zf:
+            with zf.open(member, 'w') as zout:
+                with io.TextIOWrapper(zout, encoding='utf8', newline='') as out:
+                    yield out
+    else:
+        with open(f, 'w') as out:
+            yield out
+
+# Write rows to an open output file. columns is a list with an array (or
+# list) of values for each field, all of the same length.
+def write_rows(out, columns):
+    columns = [np.asarray(col) for col in columns]
+    c = csv.writer(out)
+    n = len(columns[0]) if columns else 0
+    with stage('format') as s:
+        for i in range(0, n, BLOCKSIZE):
+            block = slice(i, i + BLOCKSIZE)
+            c.writerows(zip(*[col[block].tolist() for col in columns]))
+        s.rows += n
+
+# the csv text of rows, as write_rows would write them
+def format_rows(columns):
+    out = io.StringIO()
+    write_rows(out, columns)
+    return out.getvalue()
+
+# Write a .csv file with a header line, then the rows given by columns (see
+# write_rows).
+def write_csv(f, fieldnames, columns, level=6):
+    with stage('write'), output_file(f, level) as out:
+        csv.writer(out).writerow(fieldnames)
+        write_rows(out, columns)
+
+# Write a .csv file with a header line, then the rows of each item of blocks,
+# which are columns as for write_rows. blocks may be a generator, so that each
+# block is written as soon as it's made.
+def write_csv_blocks(f, fieldnames, blocks, level=6):
+    with output_file(f, level) as out:
+        csv.writer(out).writerow(fieldnames)
+        for columns in blocks:
+            with stage('write'):
+                write_rows(out, columns)
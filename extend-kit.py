@@ -16,238 +16,105 @@
 # position.
 
 # Instructions:
-# Edit the file names below, then run this script in python2 or python3.
+# Edit the file names below, then run this script in python3.
+# The package "numpy" is required; see README.md for installing it.
 
 # Edit the location of the three data files here.
 # It doesn't matter if the files are extracted or compressed.
-# All data files must be based on build 37.
+# All data files must be based on build 37, or be listed in LIFTOVER below.
 CHILDFILE = 'combined-me.csv'
 MOTHERFILE = 'combined-mom.csv'
 FATHERFILE = 'combined-dad.csv'
 OUTFILE = 'extended-me.csv'
 
+# Data files of another build, e.g. build 38, can be converted to build 37 as
+# they're read: list each with a UCSC chain file for the conversion, e.g.
+# {'me-build38.txt': 'hg38ToHg19.over.chain.gz'} (see dnakit/liftover.py).
+# The positions that can't be converted are listed in a file named like the
+# data file, ending in .unmapped.csv.
+LIFTOVER = {}
+
+# To write a compressed file, end the output file name with .csv.gz or .zip.
+# Compression level, from 1 (fastest) to 9 (smallest file).
+COMPRESSLEVEL = 6
+
+# Folder for keeping already-read kits, so the next run with the same data
+# files doesn't have to read them again. Set to None to not use a cache.
+# It's safe to delete the folder at any time.
+CACHEDIR = 'kit-cache'
+
+# To run several trios at once, e.g. for all of the children in a family, list
+# them in a .csv file, one trio per line: child, mother, father, output file.
+# Each kit is read only once, however many trios it's part of. When this is
+# set, the four file names above are not used.
+MANIFEST = None
+
+# Number of data files to read, and trios to extend, at the same time, each
+# in its own process. Use 1 for one after another, or None to use all
+# processors.
+WORKERS = None
+
+# To find out where the time goes, name a .json file here, e.g. 'extend-stages.json':
+# the time, processor time, rows and peak memory of each stage of the work are
+# written to it. Tracing the memory slows the run down. Only the stages done
+# in this process are seen in detail; use WORKERS = 1 to see them all.
+STAGEREPORT = None
+
+# With STAGEREPORT, also save a cProfile of each stage in this folder, e.g.
+# 'profiles'. They can be read with python's pstats module.
+PROFILEDIR = None
+
 #--- adjust file names above this line, then run ---
 
-import zipfile
 import csv
-import gzip
-import errno
-import io
 import sys
-import itertools
-
-# these are used variously to indicate a no-call at the position
-# in the combined kit, we omit these
-NOVALUE = ('-', '--', '00', 'DD', 'II', 'I', 'D', 'DI')
-
-# data that was read in
-childkit = {}
-motherkit = {}
-fatherkit = {}
-rsids = {}
-
-# make sure chromosome name is presented consistently
-# sometimes X results present as 'X', 'XY', '23', or '25' - always use '23'
-# sometimes MT results present as '26'
-# sometimes Y results present as '24'
-xmap = {'X': '23', '25': '23', 'XY': '23',
-        '26': 'MT',
-        '24': 'Y'}
-def normalize_chr(chrom):
-    try:
-        c = xmap[chrom]
-    except KeyError:
-        c = chrom
-    return c
-
-# guess the gender of the tester based on chr23 data
-# if there are many heterozygous calls, the kit is probably female
-# input is a dictionary, key=(chr,pos) and val=alleles
-def guess_gender(kit):
-    gender = 'F'
-    chr23 = [kit[k] for k in kit if k[0] == '23']
-    homocount = len([a for a in chr23 if len(a) == 1 or a[0] == a[1]])
-    if 1.0 * homocount/len(chr23) > .95: # arbitrary magic number
-        gender = 'M'
-    return gender
-
-# Read the data files
-# File types currently handled:
-#   .csv, .txt: plain csv file
-#   .csv.gz: compressed csvfile
-#   .zip: zipped csvfile
-# if there is a problem with a .zip, try unzipping it before running
-for ff,dd in [(CHILDFILE,childkit), (MOTHERFILE,motherkit),
-                  (FATHERFILE,fatherkit)]:
-    if not ff:
-        print('File(s) missing - requires 3 files. Stopping.')
-        sys.exit(0)
-    try:
-        if ff.lower().endswith('.csv.gz'):
-            with gzip.open(ff, 'rt') as gf:
-                lines = [l for l in gf.readlines() if not l.startswith('#')]
-        elif ff.lower().endswith('.zip'):
-            with zipfile.ZipFile(ff) as zf:
-                for info in zf.filelist:
-                    csvf = info.filename
-                    if csvf.lower().endswith('.txt') or csvf.lower().endswith('.csv'):
-                        break
-                with zf.open(csvf) as fname:
-                    textfile = io.TextIOWrapper(fname, encoding='utf8')
-                    lines = [str(l) for l in textfile.readlines()
-                             if not l.startswith('#')]
-        elif ff.lower().endswith('.csv') or ff.lower().endswith('.txt'):
-            lines = [l for l in open(ff, 'r').readlines()
-                         if not l.startswith('#')]
-        else:
-            print('Skipping unrecognized file type: {} - use .csv, .txt, or .zip'.format(ff))
-            continue
-    except IOError as ioe:
-        if ioe.errno == errno.ENOENT:
-            print('Could not find {} - check file name and readability.'.format(ff))
-            continue
-        else:
-            print('There may be a problem with {} - did not read it.'.format(ff))
-            continue
-    except TypeError:
-        print('There was a problem processing {} - try unzipping it.'.format(ff))
-        # raise
-        continue
-    except Exception as e:
-        print('Error {} happened while processing {} - continuing.'.format(e,ff))
-        continue
-
-    # standardize field names and csv flavor
-    # handles either rsid,chr,pos,result or rsid,chr,pos,allele1,allele2
-    try:
-        dialect = csv.Sniffer().sniff(''.join(lines[0:10]))
-    except:
-        print('{} does not appear to contain csv data - aborting'.format(ff))
-        raise
-    d = csv.DictReader(lines, dialect=dialect)
-    ncols = len(d.fieldnames)
-    if ncols not in (4,5):
-        raise ValueError('unhandled type of csv file {} with fields{}'.
-                             format(ff,d.fieldnames))
-    fieldnames = ['rsid', 'chromosome', 'position']
-    if ncols == 4:
-        fieldnames.append('result')
-    else:
-        fieldnames += ['allele1', 'allele2']
-    if d.fieldnames[0].lower().strip() == 'rsid':
-        d = csv.DictReader(lines[1:], fieldnames=fieldnames, dialect=dialect)
+
+from dnakit.extend import FIELDNAMES, extend_part
+from dnakit.stages import start_recording, stage, write_report
+from dnakit.trio import read_manifest, load_trio_kits, run_trios
+from dnakit.writer import output_file
+
+def main():
+    if STAGEREPORT:
+        start_recording(profile_dir=PROFILEDIR)
+    if MANIFEST:
+        trios = read_manifest(MANIFEST)
     else:
-        d = csv.DictReader(lines, fieldnames=fieldnames, dialect=dialect)
-
-    # Process each line of the input file.
-    for tup in d:
-        chrom = normalize_chr(tup['chromosome'])
-        if chrom == '0':
-            print('Skipping {}'.format(tup))
-            continue
-        kv = (chrom, tup['position'])
-        if ncols==5:
-            result = tup['allele1']+tup['allele2']
-        else:
-            result = tup['result']
-
-        # special case for FamilyFinder (ignore embedded "X" csv header)
-        if result == 'RESULT':
-            continue
-
-        try:
-            dd[kv] = result[0] + result[1]
-        except:
-            dd[kv] = result[0]
-        rsids[kv] = tup['rsid']
-
-    print('Done with {}; positions now stored: {}'.format(ff,len(dd)))
-# just completed the read of all three files
-
-# determine the gender of the child
-gender = guess_gender(childkit)
-print('Child appears to be {} gender'.format(gender))
-
-# go through all values in the mother's kit to see if we can use them
-for kv in motherkit:
-    try:
-        cv = childkit[kv]
-    except:
-        cv = None
-    try:
-        fv = fatherkit[kv]
-    except:
-        fv = None
-
-    # child already has this value
-    if cv and cv not in NOVALUE:
-        continue
-
-    mv = motherkit[kv]
-
-    # continue if there's insufficient data for us to use at this position
-    try:
-        chrnum = int(kv[0])
-        chr23 = (chrnum == 23)
-    except:
-        chr23 = False
-    # chr23 = (kv[0] == '23')
-    chrY = (kv[0] == 'Y')
-    chrMT = (kv[0] == 'MT')
-    chrAT = not (chr23 or chrY or chrMT)
-    Female = (gender == 'F')
-    if (chr23 or chrMT) and (not mv or (mv in NOVALUE)):
-        continue
-    elif chrY and (Female or (not fv or (fv in NOVALUE))):
-        continue
-    elif chrAT and (not fv or (fv in NOVALUE)):
-        continue
-
-    # mother is heterozygous - can't figure out child
-    if len(mv)==2 and (2*mv[0] != mv):
-        continue
-
-    # male child got mother's chr23
-    if chr23 and not Female:
-        childkit[kv] = mv[0]
-        continue
-
-    # male child got father's Y value
-    if chrY and not Female:
-        childkit[kv] = fv[0]
-        continue
-
-    # any child got mother's MT value
-    if chrMT:
-        childkit[kv] = mv[0]
-        continue
-
-    # father is heterozygous - can't figure out child
-    if 2*fv[0] != fv:
-        continue
-
-    # infer child from mother and father
-    childkit[kv] = mv[0]+fv[0]
-
-# sort the output by chromosome, position
-chr_order = ['1', '2', '3', '4', '5', '6', '7', '8', '9', '10', '11', '12',
-    '13', '14', '15', '16', '17', '18', '19', '20', '21', '22', '23',
-    'MT', 'Y']
-outkeys = list(childkit)
-outkeys.sort(key=lambda x:(chr_order.index(x[0]),int(x[1])))
-
-nocalls = 0
-# write the output as a .csv file
-with open(OUTFILE, 'w') as csvfile:
-    fieldnames = ['RSID', 'CHROMOSOME', 'POSITION', 'RESULT']
-    c = csv.DictWriter(csvfile, fieldnames=fieldnames)
-    c.writeheader()
-    for kv in outkeys:
-        if childkit[kv] not in NOVALUE:
-            c.writerow({'RSID': rsids[kv], 'CHROMOSOME': kv[0],
-                            'POSITION': kv[1], 'RESULT': childkit[kv]})
-        else:
-            nocalls += 1
-
-# summarize
-print('Child kit now {}.'.format(len(childkit)))
+        trios = [(CHILDFILE, MOTHERFILE, FATHERFILE, OUTFILE)]
+        if not all(trios[0][0:3]):
+            print('File(s) missing - requires 3 files. Stopping.')
+            sys.exit(0)
+
+    # Read the data files
+    # File types currently handled:
+    #   .csv, .txt: plain csv file
+    #   .csv.gz: compressed csvfile
+    #   .zip: zipped csvfile
+    # if there is a problem with a .zip, try unzipping it before running
+    kits = load_trio_kits(trios, CACHEDIR, WORKERS, LIFTOVER)
+
+    # Extend each chromosome of each trio; they are independent of each
+    # other, apart from the gender, which is guessed from the child's whole
+    # chr23
+    results = run_trios(extend_part, trios, kits, WORKERS)
+
+    for trio, (gender, parts) in zip(trios, results):
+        outfile = trio[3]
+        print('Child appears to be {} gender ({})'.format(
+            gender, kits[trio[0]].sex_counts().summary()))
+
+        # write the output as a .csv file
+        with stage('write'), output_file(outfile, COMPRESSLEVEL) as csvfile:
+            csv.writer(csvfile).writerow(FIELDNAMES)
+            for text, n in parts:
+                csvfile.write(text)
+
+        # summarize
+        print('Wrote {}'.format(outfile))
+        print('Child kit now {}.'.format(sum(n for text, n in parts)))
+    write_report(STAGEREPORT)
+
+# files are read and trios extended in separate processes, which must not run
+# main() again
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,129 @@
+#!/usr/bin/env python
+
+# License: GPLv3. See accompanying LICENSE file.
+# No warranty. You are responsible for your use of this program.
+
+# Purpose:
+# Compare two DNA kits one-to-one, to find the segments where the two testers
+# may share DNA, without uploading the kits to a matching service. This
+# program accepts raw data from AncestryDNA, 23andMe, FTDNA, MyHeritage,
+# LivingDNA, and other data files that have a format similar to one of these,
+# as well as the kits written by combine-kits.py and extend-kit.py.
+# The two kits are lined up by position. Where each tester is homozygous for
+# a different allele (an "opposite homozygote", e.g. AA and GG), they can't
+# share DNA. The runs of positions with no opposite homozygote are the
+# half-identical segments; those long enough are written to a .csv file,
+# with the first and last position and the number of SNPs of each. The file
+# can be given to cluster-segments.py.
+#
+# Segment lengths are in base pairs, which are only roughly comparable to the
+# centimorgans reported by the matching services, unless a genetic map is
+# given below. Only chromosomes 1-22 and X are compared.
+
+# Instructions:
+# Edit the file names below, then run this script in python3.
+# The package "numpy" is required; see README.md for installing it.
+
+# Edit the location of the two data files here.
+# It doesn't matter if the files are extracted or compressed.
+# All data files must be based on build 37, or be listed in LIFTOVER below.
+KITFILE1 = 'combined-me.csv'
+KITFILE2 = 'combined-cousin.csv'
+OUTFILE = 'segments-me-cousin.csv'
+
+# Data files of another build, e.g. build 38, can be converted to build 37 as
+# they're read: list each with a UCSC chain file for the conversion, e.g.
+# {'me-build38.txt': 'hg38ToHg19.over.chain.gz'} (see dnakit/liftover.py).
+# The positions that can't be converted are listed in a file named like the
+# data file, ending in .unmapped.csv.
+LIFTOVER = {}
+
+# Shortest segment written: number of SNPs both kits have called in it, and
+# length in base pairs. Two kits from different companies may have fewer
+# positions in common than two kits from the same company.
+MINSNPS = 300
+MINBP = 7000000
+
+# To also give the length of each segment in centimorgans (cM), as the
+# matching services do, name a genetic map here: a file, or a folder of files,
+# e.g. 'genetic_map_hg19_withX.txt.gz' (see dnakit/genmap.py for the formats
+# it can be). It must be build 37, like the kits. Segments shorter than MINCM
+# are then left out too.
+GENETICMAP = None
+MINCM = 7
+
+# Folder for keeping already-read kits, so the next run with the same data
+# files doesn't have to read them again. Set to None to not use a cache.
+# It's safe to delete the folder at any time.
+CACHEDIR = 'kit-cache'
+
+# Number of data files to read at the same time, each in its own process.
+# Use 1 for one after another, or None to use all processors.
+WORKERS = None
+
+# To find out where the time goes, name a .json file here, e.g. 'match-stages.json':
+# the time, processor time, rows and peak memory of each stage of the work are
+# written to it. Tracing the memory slows the run down.
+STAGEREPORT = None
+
+# With STAGEREPORT, also save a cProfile of each stage in this folder, e.g.
+# 'profiles'. They can be read with python's pstats module.
+PROFILEDIR = None
+
+#--- adjust file names above this line, then run ---
+
+import sys
+
+from dnakit.genmap import load_map
+from dnakit.kit import load_kits
+from dnakit.match import SEGMENT_CHROMS, match_kits
+from dnakit.stages import start_recording, write_report
+
+def main():
+    if STAGEREPORT:
+        start_recording(profile_dir=PROFILEDIR)
+    if not (KITFILE1 and KITFILE2):
+        print('File(s) missing - requires 2 files. Stopping.')
+        sys.exit(0)
+    gmap = None
+    if GENETICMAP:
+        gmap = load_map(GENETICMAP, CACHEDIR)
+        if gmap is None:
+            sys.exit(1)
+
+    kits = load_kits([KITFILE1, KITFILE2], CACHEDIR, WORKERS, None,
+                     LIFTOVER)
+    for f, kit in zip([KITFILE1, KITFILE2], kits):
+        if kit is None:
+            print('Could not read {}. Stopping.'.format(f))
+            sys.exit(1)
+        print('Done with {}; positions read: {}'.format(f, len(kit)))
+
+    segments, compared, opposite = match_kits(kits[0], kits[1], MINSNPS,
+                                                  MINBP)
+    if gmap:
+        segments = segments.with_cm(gmap)
+        segments = segments.take(segments.cm >= MINCM)
+    segments.write(OUTFILE)
+
+    # summarize
+    print('Positions compared: {}\nOpposite homozygotes: {}'.format(
+        compared, opposite))
+    print('Segments of at least {} SNPs and {:,} bp{}: {}'.format(
+        MINSNPS, MINBP, ' and {} cM'.format(MINCM) if gmap else '',
+        len(segments)))
+    if len(segments):
+        if gmap:
+            lengths, unit = segments.cm, 'cM'
+        else:
+            lengths, unit = segments.lengths() / 1e6, 'Mbp'
+        i = lengths.argmax()
+        print('Total length: {:.1f} {}; longest: {:.1f} {} on chr.{}'.format(
+            lengths.sum(), unit, lengths[i], unit,
+            SEGMENT_CHROMS[segments.chrom[i]]))
+    print('Wrote {}'.format(OUTFILE))
+    write_report(STAGEREPORT)
+
+# files are read in separate processes, which must not run main() again
+if __name__ == '__main__':
+    main()
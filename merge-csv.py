@@ -32,6 +32,10 @@ KEEP_OLDEST_ROW = 3  # keep row with oldest timestamp
 # time-consuming, and typically the default setting of False is best.
 csv_dialect_sniff_all = False
 
+# Number of lines at the top of each file used for detecting the csv dialect.
+# Files are read as a stream, so only these lines are held in memory at once.
+sniff_lines = 100
+
 # Columns that can differ and not be considered distinct rows. If a column is
 # listed here, differing values in the column will be reduced down to a single
 # value. For example, if you merge multiple .csv files having a Notes column,
@@ -69,7 +73,9 @@ differing_column_action = KEEP_ALL
 
 # === END SECTION YOU MAY WISH TO CHANGE ===
 
-import csv, os, six, sys, zipfile, gzip, io
+import csv, os, six, sys, itertools
+
+from dnakit.reader import open_textfile, datalines
 
 # python2 may not work with this script (untested), so print a warning
 if six.PY2:
@@ -87,44 +93,6 @@ if os.path.exists(sys.argv[-1]):
     print('Remove it and re-run or use a different output file name')
     sys.exit(-1)
 
-# Helper routine to open a csv file and return the lines contained in it.
-# The .csv file may be in a .zip file or gzipped or plain text
-def get_filelines(f):
-    try:
-        if f.lower().endswith('.csv.gz'):
-            with gzip.open(f, 'rt') as gf:
-                lines = [l for l in gf.readlines() if not l.startswith('#')]
-        elif f.lower().endswith('.zip'):
-            with zipfile.ZipFile(f) as zf:
-                for info in zf.filelist:
-                    csvf = info.filename
-                    if csvf.lower().endswith('.txt') or csvf.lower().endswith('.csv'):
-                        break
-                with zf.open(csvf) as fname:
-                    textfile = io.TextIOWrapper(fname, encoding='utf8')
-                    lines = [str(l) for l in textfile.readlines()
-                             if not l.startswith('#')]
-        elif f.lower().endswith('.csv') or f.lower().endswith('.txt'):
-            lines = [l for l in open(f, 'r').readlines() if not l.startswith('#')]
-        else:
-            print('Skipping unrecognized file {} of type: {} - use .csv, .txt, or .zip'.format(f))
-            return None
-    except IOError as ioe:
-        if ioe.errno == errno.ENOENT:
-            print('Could not find {} - check file name and readability.'.format(f))
-            return None
-        else:
-            print('There may be a problem with {} - did not read it.'.format(f))
-            return None
-    except TypeError:
-        print('There was a problem processing {} - try unzipping it.'.format(f))
-        # raise
-        return None
-    except Exception as e:
-        print('Error "{}" happened while processing {} - continuing.'.format(e,f))
-        return None
-    return lines
-
 # Helper routine for row merging of values that are OK to differ
 # One of two rows is returned, based on the selection criteria (e.g.: newest)
 # The first row item is a timestamp
@@ -168,11 +136,17 @@ key_fields = None
 changed_fields = None
 for fname in filenames:
     # make sure input appears to be .csv file
-    lines = get_filelines(fname)
+    # the .csv file may be in a .zip file or gzipped or plain text
+    stream = open_textfile(fname)
+    if stream is None:
+        continue
+    lines = datalines(stream)
+    head = list(itertools.islice(lines, sniff_lines))
+    lines = itertools.chain(head, lines)
     if (not dialect) or csv_dialect_sniff_all:
         try:
             print('Detecting what sort of .csv file this is...')
-            dialect = csv.Sniffer().sniff(''.join(lines))
+            dialect = csv.Sniffer().sniff(''.join(head))
             # quote character can be problematic; assume escaped by double-quoting
             dialect.doublequote = True
             dialect.quoting = csv.QUOTE_MINIMAL
@@ -199,6 +173,7 @@ for fname in filenames:
     if d.fieldnames != fieldnames:
         print('{} is not identical to {}'.format(fname,filenames[0]))
         print('Skipping it and continuing.')
+        stream.close()
         continue
 
     # add row to output if it doesn't already exist
@@ -216,6 +191,7 @@ for fname in filenames:
             # have not stored this row yet - store it
             merged_output[key] = val
 
+    stream.close()
     print('finished reading lines from {}'.format(fname))
 
 
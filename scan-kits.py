@@ -0,0 +1,158 @@
+#!/usr/bin/env python
+
+# License: GPLv3. See accompanying LICENSE file.
+# No warranty. You are responsible for your use of this program.
+
+# Purpose:
+# Compare one DNA kit with every kit in a folder, e.g. all of the kits of a
+# project, to find the segments it may share with each of them. This is the
+# one-to-many version of match-kits.py, and finds the same segments. The kits
+# in the folder are packed as bits (see dnakit/cohort.py), so hundreds of
+# them fit in memory, and each is compared with the one kit in a few
+# hundredths of a second.
+# The output is a .csv file with the segments found with every kit, the kit's
+# file name in the first column, and a summary of the kits with the most
+# shared DNA is printed.
+
+# Instructions:
+# Edit the file names below, then run this script in python3.
+# The package "numpy" is required; see README.md for installing it.
+
+# The kit to compare, and the folder of the kits to compare it with. Every
+# file in the folder is read, apart from KITFILE itself.
+# It doesn't matter if the files are extracted or compressed.
+# All data files must be based on build 37, or be listed in LIFTOVER below.
+KITFILE = 'combined-me.csv'
+KITDIR = 'project-kits'
+OUTFILE = 'segments-me-project.csv'
+
+# Data files of another build, e.g. build 38, can be converted to build 37 as
+# they're read: list each with a UCSC chain file for the conversion, e.g.
+# {'project-kits/cousin-build38.txt': 'hg38ToHg19.over.chain.gz'} (see
+# dnakit/liftover.py). The positions that can't be converted are listed in a
+# file named like the data file, ending in .unmapped.csv.
+LIFTOVER = {}
+
+# Shortest segment written: number of SNPs both kits have called in it, and
+# length in base pairs (see match-kits.py).
+MINSNPS = 300
+MINBP = 7000000
+
+# To also give the length of each segment in centimorgans (cM), as the
+# matching services do, name a genetic map here: a file, or a folder of files,
+# e.g. 'genetic_map_hg19_withX.txt.gz' (see dnakit/genmap.py for the formats
+# it can be). It must be build 37, like the kits. Segments shorter than MINCM
+# are then left out too.
+GENETICMAP = None
+MINCM = 7
+
+# Number of kits listed in the summary, with the most shared DNA first
+SHOW = 20
+
+# Folder for keeping already-read kits, so the next run with the same data
+# files doesn't have to read them again. Set to None to not use a cache, but
+# then each file is read twice. It's safe to delete the folder at any time.
+CACHEDIR = 'kit-cache'
+
+# Number of data files to read, and kits to compare, at the same time, each
+# in its own process. Use 1 for one after another, or None to use all
+# processors.
+WORKERS = None
+
+# To find out where the time goes, name a .json file here, e.g. 'scan-stages.json':
+# the time, processor time, rows and peak memory of each stage of the work are
+# written to it. Tracing the memory slows the run down. Only the stages done
+# in this process are seen in detail; use WORKERS = 1 to see them all.
+STAGEREPORT = None
+
+# With STAGEREPORT, also save a cProfile of each stage in this folder, e.g.
+# 'profiles'. They can be read with python's pstats module.
+PROFILEDIR = None
+
+#--- adjust file names above this line, then run ---
+
+import os
+import sys
+
+import numpy as np
+
+from dnakit.cohort import Cohort, scan_cohort
+from dnakit.genmap import load_map
+from dnakit.kit import load_kit
+from dnakit.liftover import unmapped_path
+from dnakit.match import CM_FIELD, FIELDNAMES
+from dnakit.stages import start_recording, write_report
+from dnakit.writer import write_csv
+
+def main():
+    if STAGEREPORT:
+        start_recording(profile_dir=PROFILEDIR)
+    if not os.path.isdir(KITDIR):
+        print('Folder {} not found. Stopping.'.format(KITDIR))
+        sys.exit(1)
+    gmap = None
+    if GENETICMAP:
+        gmap = load_map(GENETICMAP, CACHEDIR)
+        if gmap is None:
+            sys.exit(1)
+    files = [os.path.join(KITDIR, f) for f in sorted(os.listdir(KITDIR))
+                 if not f.startswith('.')]
+    # the lists of positions that couldn't be converted aren't kits
+    unmapped = set(unmapped_path(f) for f in files)
+    files = [f for f in files if os.path.isfile(f) and f not in unmapped and
+                 os.path.abspath(f) != os.path.abspath(KITFILE)]
+
+    cohort, manifest = Cohort.from_files(files, CACHEDIR, WORKERS,
+                                         liftover=LIFTOVER)
+    for f in files:
+        if f not in cohort.names:
+            print('Skipping {} - could not read it'.format(f))
+    print('Kits to compare with: {}'.format(len(cohort)))
+    kit = load_kit(KITFILE, CACHEDIR, manifest, LIFTOVER)
+    if kit is None:
+        print('Could not read {}. Stopping.'.format(KITFILE))
+        sys.exit(1)
+    print('Done with {}; positions read: {}'.format(KITFILE, len(kit)))
+
+    results = scan_cohort(cohort, kit, MINSNPS, MINBP, WORKERS)
+    found = []
+    for name, (segments, compared, opposite) in zip(cohort.names, results):
+        if gmap:
+            segments = segments.with_cm(gmap)
+            segments = segments.take(segments.cm >= MINCM)
+        if len(segments):
+            found.append((name, segments))
+
+    # the segments of all of the kits, in one file
+    fieldnames = FIELDNAMES + ([CM_FIELD] if gmap else [])
+    columns = [[] for f in fieldnames]
+    names = []
+    for name, segments in found:
+        names += [name] * len(segments)
+        for col, values in zip(columns, segments.output_columns()):
+            col.append(values)
+    write_csv(OUTFILE, ['Kit'] + fieldnames,
+              [names] + [np.concatenate(col) if col else [] for col in columns])
+
+    # summarize
+    print('Kits sharing segments of at least {} SNPs and {:,} bp{}: {}'.format(
+        MINSNPS, MINBP, ' and {} cM'.format(MINCM) if gmap else '',
+        len(found)))
+    if gmap:
+        unit = 'cM'
+        found = [(segments.cm, name, segments) for name, segments in found]
+    else:
+        unit = 'Mbp'
+        found = [(segments.lengths() / 1e6, name, segments)
+                     for name, segments in found]
+    for lengths, name, segments in sorted(found, key=lambda x: -x[0].sum())[
+            :SHOW]:
+        print('{}: {} segments, {:.1f} {} in total, longest {:.1f} {}'.format(
+            name, len(segments), lengths.sum(), unit, lengths.max(), unit))
+    print('Wrote {}'.format(OUTFILE))
+    write_report(STAGEREPORT)
+
+# files are read and kits compared in separate processes, which must not run
+# main() again
+if __name__ == '__main__':
+    main()